@@ -0,0 +1,168 @@
+# ai_executor.py
+# Runs AI decisions off the socket handlers on a bounded thread pool.
+#
+# submit() queues decide(), and callback(action, timed_out) is called once
+# with its result, or with the fallback action if the deadline passes
+# first. A late result is dropped, though the overrunning decision keeps
+# its worker busy until it returns. When max_pending decisions are already
+# waiting the fallback is applied at once instead of growing the backlog.
+#
+# Threads rather than processes: a decision reads a detached copy of its
+# table (PokerGame.copy), which would otherwise have to be pickled for every
+# action. Equity sampling that needs more CPU can still fan out to processes
+# through equity.equity().
+#
+# Callbacks run on the pool thread that made the decision, or for a timeout
+# on a separate pool of callback threads, never on the deadline thread, so
+# one slow or locked table does not hold up the deadlines of the others. They must
+# take whatever lock guards the table they touch. An exception from a
+# callback is logged and counted in callback_errors.
+
+import heapq
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class _Decision:
+    __slots__ = ('callback', 'fallback', 'submitted', 'deadline', 'settled')
+
+    def __init__(self, callback, fallback, submitted, deadline):
+        self.callback = callback
+        self.fallback = fallback
+        self.submitted = submitted
+        self.deadline = deadline
+        self.settled = False
+
+    def __lt__(self, other):
+        return self.deadline < other.deadline
+
+
+class AIExecutor:
+    def __init__(self, workers=4, deadline=0.5, max_pending=1000, latency_window=10000):
+        self.deadline = deadline
+        self.max_pending = max_pending
+        self.pending = 0  # submitted and not yet settled
+        self.submitted = 0
+        self.completed = 0
+        self.timeouts = 0
+        self.rejected = 0  # fallback applied because the backlog was full
+        self.late = 0  # results that arrived after their deadline
+        self.errors = 0
+        self.callback_errors = 0
+        self._latencies = deque(maxlen=latency_window)
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ai')
+        # Timeout fallbacks, kept apart from the pool that overrunning
+        # decisions may be holding
+        self._callbacks = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ai-callback')
+        self._timers = []
+        self._wakeup = threading.Condition(self._lock)
+        self._closed = False
+        self._watchdog = threading.Thread(target=self._watch, name='ai-deadlines', daemon=True)
+        self._watchdog.start()
+
+    def submit(self, decide, callback, fallback, deadline=None):
+        ## Run decide() on the pool; callback(action, timed_out) gets its
+        ## result or `fallback` once `deadline` seconds have passed
+        now = time.monotonic()
+        with self._lock:
+            if self.pending >= self.max_pending or self._closed:
+                self.rejected += 1
+                rejected = True
+            else:
+                rejected = False
+                decision = _Decision(callback, fallback, now,
+                                     now + (self.deadline if deadline is None else deadline))
+                self.pending += 1
+                self.submitted += 1
+                heapq.heappush(self._timers, decision)
+                self._wakeup.notify()
+        if rejected:
+            self._deliver(callback, fallback, True)
+            return
+        self._pool.submit(self._run, decide, decision)
+
+    def _settle(self, decision, timed_out):
+        ## True if this call gets to deliver the decision
+        with self._lock:
+            if decision.settled:
+                if not timed_out:
+                    self.late += 1
+                return False
+            decision.settled = True
+            self.pending -= 1
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.completed += 1
+            self._latencies.append(time.monotonic() - decision.submitted)
+            return True
+
+    def _deliver(self, callback, action, timed_out):
+        try:
+            callback(action, timed_out)
+        except Exception:
+            with self._lock:
+                self.callback_errors += 1
+            logger.exception('AI decision callback failed')
+
+    def _run(self, decide, decision):
+        try:
+            action = decide()
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            logger.exception('AI decision failed')
+            action = decision.fallback
+        if self._settle(decision, False):
+            self._deliver(decision.callback, action, False)
+
+    def _expire(self, decision):
+        if self._settle(decision, True):
+            self._deliver(decision.callback, decision.fallback, True)
+
+    def _watch(self):
+        with self._lock:
+            while not self._closed:
+                while self._timers and self._timers[0].settled:
+                    heapq.heappop(self._timers)
+                if not self._timers:
+                    self._wakeup.wait()
+                    continue
+                wait = self._timers[0].deadline - time.monotonic()
+                if wait > 0:
+                    self._wakeup.wait(wait)
+                    continue
+                decision = heapq.heappop(self._timers)
+                self._callbacks.submit(self._expire, decision)
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            stats = {
+                'queue_depth': self.pending,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'timeouts': self.timeouts,
+                'rejected': self.rejected,
+                'late': self.late,
+                'errors': self.errors,
+                'callback_errors': self.callback_errors,
+            }
+        for name, q in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99)):
+            stats[f'latency_{name}_ms'] = \
+                latencies[min(int(q * len(latencies)), len(latencies) - 1)] * 1000 if latencies else None
+        return stats
+
+    def shutdown(self):
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify()
+        self._pool.shutdown(wait=True)
+        self._watchdog.join()
+        self._callbacks.shutdown(wait=True)
@@ -1,17 +1,80 @@
 # app.py (Backend)
 from enum import Enum
-from flask import Flask, render_template, request, session
-from flask_socketio import SocketIO, emit, join_room
+from flask import Flask, Response, jsonify, redirect, render_template, request, session
+from flask_socketio import SocketIO, join_room
+import functools
+import itertools
+import json
+import os
+import random
+import re
+import time
 import uuid
-from poker_logic import PokerGame, Player, GamePhase  # Import your existing game logic
-from threading import Lock
+import zlib
+from collections import deque
+from poker_logic import ACTIONS, PokerGame, Player, GamePhase  # Import your existing game logic
+from registry import GameRegistry
+from ai_executor import AIExecutor
+from cluster import LocalPubSubManager, table_owner
+from table_store import open_store
+from tournament import Tournament
+import metrics
+from hand_history import HandHistoryWriter
+from threading import RLock
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'secret!'
-socketio = SocketIO(app, cors_allowed_origins="*")
 
-games = {}
-game_lock = Lock()
+# Multi-process mode (see cluster.py): POKER_WORKERS lists every worker's
+# base URL and POKER_WORKER_INDEX is this one. Tables are owned by
+# table_owner(game_id); other workers' clients are sent to the owner.
+WORKER_URLS = [url for url in os.environ.get('POKER_WORKERS', '').split(',') if url]
+WORKER_INDEX = int(os.environ.get('POKER_WORKER_INDEX', 0))
+# Table snapshots, e.g. sqlite:///tables.db to share them between workers
+TABLE_STORE = os.environ.get('POKER_TABLE_STORE')
+# Broadcasts between workers, e.g. redis://localhost:6379/0; 'local' wires
+# servers within this process together for tests
+MESSAGE_QUEUE = os.environ.get('POKER_MESSAGE_QUEUE')
+
+if MESSAGE_QUEUE and MESSAGE_QUEUE.split(':')[0] == 'local':
+    socketio = SocketIO(app, cors_allowed_origins="*", client_manager=LocalPubSubManager(url=MESSAGE_QUEUE))
+else:
+    socketio = SocketIO(app, cors_allowed_origins="*", message_queue=MESSAGE_QUEUE)
+
+# A client this many versions behind on acks gets a full snapshot
+MAX_UNACKED_VERSIONS = 32
+# Published versions each table keeps for clients that reconnect
+EVENT_RING_SIZE = 64
+PAYLOAD_SAMPLE_EVERY = 16  # emits per payload size observation
+
+# Idle tables: hibernate joined ones after TABLE_IDLE_TTL seconds, drop
+# them after TABLE_EVICT_TTL, keep at most MAX_LIVE_TABLES in memory (a
+# table count, see registry.py for sizing it)
+TABLE_IDLE_TTL = 600
+TABLE_EVICT_TTL = 86400
+MAX_LIVE_TABLES = 5000
+SWEEP_INTERVAL = 30
+
+# AI-only tournaments started over the socket API. These caps keep one
+# client from tying up the server; big fields are for tournament.py and
+# benchmarks.py.
+MAX_TOURNAMENT_ENTRANTS = 500
+MAX_TOURNAMENT_HANDS_PER_LEVEL = 20
+MAX_TOURNAMENT_CHIPS = 10000
+MAX_RUNNING_TOURNAMENTS = 4  # on this server
+MAX_TOURNAMENTS_PER_SID = 1
+TOURNAMENT_SLICE_STEPS = 5000  # table turns between two tournament_update emits
+
+# Hand histories are only written when a directory is configured
+HAND_HISTORY_DIR = os.environ.get('POKER_HAND_HISTORY_DIR')
+hand_history = HandHistoryWriter(HAND_HISTORY_DIR) if HAND_HISTORY_DIR else None
+
+# AI decisions run on this many pool threads, each with a deadline after
+# which the seat checks or folds. 0 plays AI seats inline in the handler.
+AI_WORKERS = int(os.environ.get('POKER_AI_WORKERS', 4))
+AI_DECISION_DEADLINE = 0.5
+AI_MAX_PENDING = 1000
+ai_executor = AIExecutor(AI_WORKERS, AI_DECISION_DEADLINE, AI_MAX_PENDING) if AI_WORKERS else None
 
 
 
@@ -30,6 +93,17 @@ class GameSession:
         self.ai_count = num_ai
         self.game = None  # Changed from empty PokerGame to None
         self.started = False  # Add game status flag
+        self.lock = RLock()  # guards this table only
+        self.version = 0  # bumped on every published change
+        self.turn = 0  # bumped on every action and restart; stale AI results are dropped
+        self.client_views = {}  # sid -> last sent view and acked version
+        self.actions = []  # played since the last publish, sent along with it
+        # The state version is the table's event sequence number: every
+        # publish is one event, kept here as its actions and public delta
+        self.events = deque(maxlen=EVENT_RING_SIZE)
+        self._public = None  # public state as of the last publish
+        self.last_active = time.monotonic()
+        self.retired = False  # set once hibernated; a rehydrated copy takes over
         
     def add_human(self, sid, name):
         if len(self.players) + self.ai_count > 10:
@@ -44,63 +118,439 @@ class GameSession:
     #         self.players.append(Player(f"AI {i+1}", ai_level=1))
         
     #         # Reinitialize game with actual players
-    #         self.game = PokerGame(self.players)
+    #         self.game = PokerGame(self.players, headless=True)
     #         self.game.new_deck()
     #         self.game.deal_hole_cards()
 
     def start_game(self):
-        # Create AI players first
+        # Keep the humans and (re)create the AI seats
+        self.players = [p for p in self.players if p.ai_level == 0]
         for i in range(self.ai_count):
             self.players.append(Player(f"AI {i+1}", ai_level=1))
         
-        # Initialize game with validated players
-        self.game = PokerGame(self.players)  # start_new_hand is called automatically in __init__
-        self.game.current_player = self.game.players[0]
+        # Initialize game with validated players and deal the first hand.
+        # The caller plays the AI seats, see run_ai() and drive_ai().
+        self.game = PokerGame(self.players, headless=True)
+        self._attach_history()
+        self.game.start_hand()
         self.started = True
-     
+        self.turn += 1
 
-    def get_game_state(self, for_player=None):
-        with game_lock:
-            state = {
-                'current_player': None,
-                'phase': 'Waiting to Start',
-                'community_cards': [],
-                'pot': 0,
-                'players': [],
-                'current_bet': 0,
-                'is_player_turn': False,
-                'player_chips': 0
-            }
-            
-            if self.game:
-                state['current_player'] = self.game.current_player.name if self.game.current_player else None
-
-                state['phase'] = self.game.current_phase.value
-                 # Add actual game data
-                state.update({
-                    'community_cards': [str(c) for c in self.game.community_cards],
-                    'pot': self.game.pot,
-                    'phase': self.game.current_phase.value,
-                    'current_bet': self.game.current_bet,
-                    'current_player': self.game.current_player.name if self.game.current_player else None
+    def _attach_history(self):
+        if hand_history is not None:
+            self.game.recorder = hand_history.recorder(self.game_id)
+
+    def apply(self, player, action, amount=None):
+        game = self.game
+        current_bet, bet_before = game.current_bet, player.current_bet
+        game.apply_action(player, action, amount)
+        self.turn += 1
+        # What actually happened: a fold facing no bet is a check, a capped
+        # raise a call
+        if player.folded:
+            action = 'fold'
+        elif game.current_bet > current_bet:
+            action = 'raise'
+        else:
+            action = 'call' if player.current_bet > bet_before else 'check'
+        self.actions.append({'type': 'action', 'player': player.name, 'action': action,
+                             'amount': player.current_bet - bet_before})
+
+    def fallback_action(self, player):
+        ## What an AI seat does when its decision runs out of time
+        return 'call' if self.game.current_bet <= player.current_bet else 'fold'
+
+    def run_ai(self):
+        ## Play AI turns inline until a human has to act
+        player = self.settle()
+        while player is not None:
+            self.apply(player, self.game.ai_decision(player))
+            player = self.settle()
+
+    def settle(self):
+        ## Deal streets and pay out finished hands until someone has to act,
+        ## noting both in self.actions. Returns the AI seat to act, or None
+        ## once it is a human's turn or play has stopped.
+        game = self.game
+        while True:
+            if game.current_phase == GamePhase.SHOWDOWN:
+                pot = game.pot
+                winners = game.finish_hand()
+                self.actions.append({
+                    'type': 'result',
+                    'winners': [w.name for w in winners],
+                    'pot': pot,
+                    'pots': [{'amount': p.amount, 'winners': [w.name for w in p.winners]}
+                             for p in game.last_pots]
                 })
-                
-                # Add proper player states
-                for p in self.game.players:
-                    player_state = {
-                        'name': p.name,
-                        'chips': p.chips,
-                        'current_bet': p.current_bet,
-                        'hand': [str(c) for c in p.hand] if p == for_player else ['XX']*2,
-                        'is_ai': p.ai_level > 0
-                    }
-                    state['players'].append(player_state)
-                    
-                    if p == for_player:
-                        state['is_player_turn'] = (self.game.current_player == p)
-                        state['player_chips'] = p.chips
+                # Only deal on while a human can still play
+                if not any(p.ai_level == 0 and p.chips > 0 for p in self.players) or \
+                        not game.start_hand():
+                    return None
+            elif game.street_complete:
+                game.next_street()
+                if game.current_phase != GamePhase.SHOWDOWN:
+                    self.actions.append({'type': 'board', 'phase': game.current_phase.value,
+                                         'cards': [str(c) for c in game.community_cards]})
+            elif game.current_player.ai_level > 0:
+                return game.current_player
+            else:
+                return None
+
+
+    def _build_state(self):
+        ## Public view of the table: every hand hidden
+        state = {
+            'current_player': None,
+            'phase': 'Waiting to Start',
+            'community_cards': [],
+            'pot': 0,
+            'players': [],
+            'current_bet': 0,
+            'is_player_turn': False,
+            'player_chips': 0
+        }
+        
+        if self.game:
+            # Add actual game data
+            state.update({
+                'community_cards': [str(c) for c in self.game.community_cards],
+                'pot': self.game.pot,
+                'phase': self.game.current_phase.value,
+                'current_bet': self.game.current_bet,
+                'current_player': self.game.current_player.name if self.game.current_player else None
+            })
             
-            return state
+            # Add proper player states
+            for p in self.game.players:
+                state['players'].append({
+                    'name': p.name,
+                    'chips': p.chips,
+                    'current_bet': p.current_bet,
+                    'hand': ['XX']*2,
+                    'is_ai': p.ai_level > 0
+                })
+        return state
+
+    def _personalize(self, public, for_player):
+        ## Copy of the public state revealing only for_player's own cards
+        if not self.game or for_player not in self.game.players:
+            return public
+        state = dict(public)
+        index = self.game.players.index(for_player)
+        state['players'] = list(public['players'])
+        state['players'][index] = dict(public['players'][index],
+                                       hand=[str(c) for c in for_player.hand])
+        state['is_player_turn'] = (self.game.current_player == for_player)
+        state['player_chips'] = for_player.chips
+        return state
+
+    def get_game_state(self, for_player=None):
+        with self.lock:
+            return self._personalize(self._build_state(), for_player)
+
+    def is_joined(self):
+        return bool(self.humans())
+
+    def to_snapshot(self):
+        ## Compact zlib'd JSON of the whole table, PokerGame included (deck
+        ## order, dealer position, bets). Client views are not kept: every
+        ## client gets a full snapshot after a restore.
+        data = {
+            'game_id': self.game_id,
+            'ai_count': self.ai_count,
+            'started': self.started,
+            'version': self.version,
+            'turn': self.turn,
+            'actions': self.actions,
+            'sids': [getattr(p, 'sid', None) for p in self.players],
+            'tokens': [getattr(p, 'token', None) for p in self.players],
+            'game': self.game.export_state() if self.game else None,
+        }
+        return zlib.compress(json.dumps(data, separators=(',', ':')).encode())
+
+    @classmethod
+    def from_snapshot(cls, blob):
+        data = json.loads(zlib.decompress(blob))
+        session = cls(data['game_id'], data['ai_count'])
+        session.started = data['started']
+        session.version = data['version']
+        session.turn = data.get('turn', 0)
+        session.actions = data.get('actions', [])
+        if data['game']:
+            session.players = [Player(name, chips, ai_level) for name, chips, ai_level, *_ in data['game']['players']]
+            for player, sid, token in zip(session.players, data['sids'],
+                                          data.get('tokens', [None] * len(data['sids']))):
+                if sid is not None:
+                    player.sid = sid
+                if token is not None:
+                    player.token = token
+            session.game = PokerGame(session.players, headless=True)
+            session.game.load_state(data['game'])
+            session._attach_history()
+        return session
+
+    def humans(self):
+        return [p for p in self.players if getattr(p, 'sid', None)]
+
+    def publish(self, full_for=()):
+        ## Bump the state version and build one game_update payload per
+        ## human: a delta against the view last sent to that sid, or a full
+        ## snapshot for sids in full_for, new sids and clients too far
+        ## behind on acks. Everything played since the last publish goes
+        ## with it as one ordered 'actions' list for the client to animate.
+        ## Returns [(sid, payload)].
+        with self.lock:
+            self.version += 1
+            actions, self.actions = self.actions, []
+            public = self._build_state()
+            # None when seats changed: nobody can be caught up across it
+            delta = state_delta(self._public, public) if self._public else None
+            self.events.append({'seq': self.version, 'actions': actions, 'delta': delta})
+            self._public = public
+            updates = []
+            for player in self.humans():
+                state = self._personalize(public, player)
+                view = self.client_views.get(player.sid)
+                delta = None
+                if view and player.sid not in full_for and \
+                        self.version - view['acked'] <= MAX_UNACKED_VERSIONS:
+                    delta = state_delta(view['state'], state)
+
+                if delta is None:
+                    payload = self._full_payload(player, state)
+                    acked = self.version
+                else:
+                    payload = {'version': self.version, 'base': view['version'], 'delta': delta}
+                    acked = view['acked']
+                if actions:
+                    payload['actions'] = actions
+                self.client_views[player.sid] = {'version': self.version, 'state': state, 'acked': acked}
+                updates.append((player.sid, payload))
+            return updates
+
+    def snapshot(self, sid):
+        ## Full state at the current version for one client, e.g. on resync
+        with self.lock:
+            player = next((p for p in self.humans() if p.sid == sid), None)
+            state = self._personalize(self._build_state(), player)
+            self.client_views[sid] = {'version': self.version, 'state': state, 'acked': self.version}
+            return self._full_payload(player, state)
+
+    def _full_payload(self, player, state):
+        ## Full snapshots only ever go to their own seat, so they also carry
+        ## the token that seat is taken back with (see rejoin_game)
+        payload = {'version': self.version, 'full': True, 'state': state}
+        if getattr(player, 'token', None):
+            payload['token'] = player.token
+        return payload
+
+    def resume(self, player, sid, seq):
+        ## Catch a reconnecting client up from the last version it saw: the
+        ## events since then in order, then its own seat's private fields.
+        ## A full snapshot if those events have left the ring, or if seq is
+        ## None.
+        with self.lock:
+            old_sid = getattr(player, 'sid', None)
+            if old_sid != sid:
+                self.client_views.pop(old_sid, None)
+            player.sid = sid
+            if seq is None:
+                return self.snapshot(sid)
+            missed = [event for event in self.events if event['seq'] > seq]
+            if seq > self.version or len(missed) != self.version - seq or \
+                    any(event['delta'] is None for event in missed):
+                return self.snapshot(sid)
+            state = self._personalize(self._build_state(), player)
+            index = self.game.players.index(player) if self.game and player in self.game.players else None
+            private = {'is_player_turn': state['is_player_turn'], 'player_chips': state['player_chips']}
+            if index is not None:
+                private['players'] = {str(index): {'hand': state['players'][index]['hand']}}
+            self.client_views[sid] = {'version': self.version, 'state': state, 'acked': seq}
+            return {'version': self.version, 'base': seq, 'events': missed, 'private': private}
+
+    def acknowledge(self, sid, version):
+        with self.lock:
+            view = self.client_views.get(sid)
+            if view and view['acked'] < version <= view['version']:
+                view['acked'] = version
+
+
+def state_delta(old, new):
+    ## Fields of new that differ from old. Players are diffed per seat as
+    ## {index: {field: value}}. None if the seats changed, since that needs
+    ## a full snapshot.
+    if len(old['players']) != len(new['players']):
+        return None
+    delta = {}
+    for key, value in new.items():
+        if key == 'players':
+            players = {}
+            for index, (before, after) in enumerate(zip(old['players'], value)):
+                changed = {k: v for k, v in after.items() if before.get(k) != v}
+                if changed:
+                    players[str(index)] = changed
+            if players:
+                delta['players'] = players
+        elif old.get(key) != value:
+            delta[key] = value
+    return delta
+
+
+# Each GameSession has its own lock; the registry only guards lookups
+games = GameRegistry(restore=GameSession.from_snapshot, idle_ttl=TABLE_IDLE_TTL,
+                     evict_ttl=TABLE_EVICT_TTL, max_live=MAX_LIVE_TABLES,
+                     store=open_store(TABLE_STORE))
+
+
+_event_seconds = metrics.histogram('poker_event_seconds', 'Socket event handler latency', ['event'])
+_payload_bytes = metrics.histogram('poker_emit_payload_bytes',
+                                   f'Size as JSON of 1 in {PAYLOAD_SAMPLE_EVERY} emitted payloads',
+                                   ['event'], metrics.SIZE_BUCKETS)
+_emits = itertools.count()
+
+
+def _table_counts():
+    stats = games.stats()
+    return {('live',): stats['live'], ('hibernated',): stats['hibernated']}
+
+
+def _player_counts():
+    humans = ai = 0
+    for table in games.values():
+        seated = len(table.humans())
+        humans += seated
+        ai += len(table.players) - seated
+    return {('human',): humans, ('ai',): ai}
+
+
+def _ai_latency():
+    if ai_executor is None:
+        return {}
+    stats = ai_executor.stats()
+    return {(quantile,): stats[f'latency_{name}_ms'] / 1000
+            for quantile, name in (('0.5', 'p50'), ('0.95', 'p95'), ('0.99', 'p99'))
+            if stats[f'latency_{name}_ms'] is not None}
+
+
+metrics.gauge('poker_tables', 'Tables in the registry', _table_counts, ['state'])
+metrics.gauge('poker_players', 'Players seated at live tables', _player_counts, ['kind'])
+metrics.gauge('poker_ai_queue_depth', 'AI decisions submitted and not yet settled',
+              lambda: ai_executor.pending if ai_executor else None)
+metrics.gauge('poker_tournaments_running', 'Tournaments being streamed',
+              lambda: len(running_tournaments))
+metrics.gauge('poker_ai_decision_latency_seconds', 'Recent AI decision latency',
+              _ai_latency, ['quantile'])
+
+
+def timed(event):
+    ## Record a socket handler's latency under poker_event_seconds
+    def wrap(handler):
+        child = _event_seconds.labels(event)
+
+        @functools.wraps(handler)
+        def timed_handler(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return handler(*args, **kwargs)
+            finally:
+                child.observe(time.perf_counter() - start)
+        return timed_handler
+    return wrap
+
+
+def send(event, payload, to=None):
+    ## socketio.emit, to the client being handled unless `to` is given.
+    ## Sizing a payload means encoding it a second time, so only one emit in
+    ## PAYLOAD_SAMPLE_EVERY is measured
+    if next(_emits) % PAYLOAD_SAMPLE_EVERY == 0:
+        _payload_bytes.labels(event).observe(len(json.dumps(payload, separators=(',', ':'))))
+    socketio.emit(event, payload, to=to if to is not None else request.sid)
+
+
+def owner_url(game_id):
+    ## Base URL of the worker serving game_id, or None if it is this one
+    if not WORKER_URLS:
+        return None
+    index = table_owner(game_id, len(WORKER_URLS))
+    return None if index == WORKER_INDEX else WORKER_URLS[index]
+
+
+def new_game_id():
+    ## A fresh id for a table this worker owns
+    while True:
+        game_id = str(uuid.uuid4())
+        if owner_url(game_id) is None:
+            return game_id
+
+
+def game_id_of(data):
+    ## The payload's game_id, or None if the payload or the id is malformed
+    game_id = data.get('game_id') if isinstance(data, dict) else None
+    return game_id if isinstance(game_id, str) else None
+
+
+def is_version(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def served_elsewhere(game_id):
+    ## Tell the client which worker owns game_id if it is not this one
+    url = owner_url(game_id)
+    if url is not None:
+        send('error', {'message': 'Game is served by another worker', 'redirect': f"{url}/game/{game_id}"})
+    return url is not None
+
+
+def drive_ai(session, full_for=()):
+    ## Play a table up to the next human turn, then publish one game_update
+    ## per human carrying every action, street and result on the way. AI
+    ## decisions go to the executor and continue in apply_ai_decision.
+    ## Caller holds session.lock.
+    player = session.settle()
+    while player is not None and ai_executor is None:
+        session.apply(player, session.game.ai_decision(player))
+        player = session.settle()
+
+    if player is None:
+        for sid, update in session.publish(full_for=full_for):
+            send('game_update', update, to=sid)
+        return
+    # The decision reads a copy: once it times out the table moves on
+    # without it, and a late thread must never touch live state. Its result
+    # is dropped by apply_ai_decision unless the table is still on this turn.
+    game_id, turn = session.game_id, session.turn
+    seat = session.game.players.index(player)
+    game = session.game.copy(random.Random(session.game.rng.getrandbits(64)))
+    player = game.players[seat]
+
+    def decide():
+        with metrics.profiler.table(game_id):
+            return game.ai_decision(player)
+    ai_executor.submit(decide,
+                       lambda action, timed_out: apply_ai_decision(game_id, turn, action, full_for),
+                       session.fallback_action(player))
+
+
+def apply_ai_decision(game_id, turn, action, full_for=()):
+    ## Executor callback: apply one AI action unless the table has moved on
+    with _event_seconds.labels('ai_action').time(), games.locked(game_id) as session:
+        if session is None or session.turn != turn:
+            return
+        player = session.game.current_player
+        try:
+            session.apply(player, action)
+        except ValueError:
+            # Rejected before it touched the table: play the fallback rather
+            # than leave the table waiting on this seat
+            session.apply(player, session.fallback_action(player))
+        drive_ai(session, full_for)
+
+
+def sweep_idle_tables():
+    while True:
+        socketio.sleep(SWEEP_INTERVAL)
+        games.sweep()
 
 
 @app.route('/')
@@ -109,101 +559,265 @@ def index():
 
 @app.route('/game/<game_id>')
 def game(game_id):
+    url = owner_url(game_id)
+    if url is not None:
+        return redirect(f"{url}/game/{game_id}")
     return render_template('game.html')
 
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/profile/<game_id>', methods=['GET', 'POST', 'DELETE'])
+def profile(game_id):
+    ## POST starts sampling one table, GET returns its collapsed stacks so
+    ## far, DELETE stops sampling and returns them
+    if request.method == 'POST':
+        metrics.profiler.enable(game_id)
+        return '', 204
+    tally = metrics.profiler.disable(game_id) if request.method == 'DELETE' \
+        else metrics.profiler.stacks(game_id)
+    if tally is None:
+        return 'Table is not being profiled\n', 404
+    return Response(metrics.collapsed(tally), mimetype='text/plain')
+
+@app.route('/stats')
+def stats():
+    return jsonify({
+        'tables': games.stats(),
+        'ai': ai_executor.stats() if ai_executor else None,
+    })
+
 @socketio.on('create_game')
+@timed('create_game')
 def handle_create_game(data):
     try:
         num_ai = int(data['num_ai'])
         if not 1 <= num_ai <= 9:
             raise ValueError("AI players must be between 1-9")
             
-        game_id = str(uuid.uuid4())
+        game_id = new_game_id()
         session = GameSession(game_id, num_ai)
-        games[game_id] = session
         
         # Add temporary human player placeholder
         session.players.append(Player("Human", ai_level=0))
         session.start_game()
+        games[game_id] = session
         
-        emit('game_created', {'game_id': game_id})
+        send('game_created', {'game_id': game_id})
     except Exception as e:
-        emit('error', {'message': str(e)})
+        send('error', {'message': str(e)})
 
 @socketio.on('join_game')
+@timed('join_game')
 def handle_join_game(data):
 
     try: 
         game_id = data['game_id']
         name = data['name']
-        session = games.get(game_id)
+        if served_elsewhere(game_id):
+            return
         
-        if session:
-        # Replace temporary human placeholder
-            human_player = next((p for p in session.players if p.name == "Human"), None)
+        with games.locked(game_id) as session:
+            if session:
+                # Replace temporary human placeholder
+                human_player = next((p for p in session.players if p.name == "Human"), None)
 
-            if human_player:
-                human_player.name = name
-                human_player.sid = request.sid
-                join_room(game_id)
-                session.start_game()
-                emit('game_update', session.get_game_state(human_player), room=game_id)
-            else:
-                emit('error', {'message': 'Game is full'})
+                if human_player:
+                    human_player.name = name
+                    human_player.sid = request.sid
+                    # Lets this seat be taken back after a reconnect, see rejoin_game
+                    human_player.token = uuid.uuid4().hex
+                    join_room(game_id)
+                    # The hand dealt by create_game carries on
+                    if not session.started:
+                        session.start_game()
+                    # Full snapshot, with the token, for the joining client,
+                    # deltas for the rest
+                    drive_ai(session, full_for={request.sid})
+                else:
+                    send('error', {'message': 'Game is full'})
 
     except Exception as e:
         print(f"Error: {str(e)}")
-        emit('error', {'message': str(e)})
+        send('error', {'message': str(e)})
 
 @socketio.on('start_game')
+@timed('start_game')
 def handle_start_game(data):
     game_id = data['game_id']
-    session = games.get(game_id)
-    if session and not session.started:
-        session.start_game()
-        session.started = True # set the game status to started
-        emit('game_update', session.get_game_state(), room=game_id)
+    if served_elsewhere(game_id):
+        return
+    with games.locked(game_id) as session:
+        if session:
+            if not session.started:
+                session.start_game()
+                session.started = True # set the game status to started
+                drive_ai(session, full_for={p.sid for p in session.humans()})
 
 @socketio.on('player_action')
+@timed('player_action')
 def handle_player_action(data):
     game_id = data['game_id']
-    session = games.get(game_id)
+    if served_elsewhere(game_id):
+        return
     
-    if session and session.game:
-        player = next((p for p in session.players if p.sid == request.sid), None)
-        
-        # Handle action
-        if data['action'] == 'fold':
-            player.folded = True
-        elif data['action'] == 'call':
-            amount = session.game.current_bet - player.current_bet
-            player.chips -= amount
-            player.current_bet += amount
-            session.pot += amount
-        elif data['action'] == 'raise':
-            amount = data['amount']
-            player.chips -= amount
-            player.current_bet += amount
-            session.game.current_bet = player.current_bet
-            session.pot += amount
-        
-        # Check round completion
-        if session.game.betting_round_complete():
-            session.game.advance_phase()
-            if session.game.current_phase == GamePhase.SHOWDOWN:
-                winners = session.game.determine_winners()
-                for winner in winners:
-                    winner.chips += session.pot // len(winners)
-                emit('game_result', {
-                    'winners': [w.name for w in winners],
-                    'pot': session.pot
-                }, room=game_id)
+    with games.locked(game_id) as session:
+        if session and session.game:
+            player = next((p for p in session.players if getattr(p, 'sid', None) == request.sid), None)
+            if player is None or player is not session.game.current_player:
+                send('action_result', {'success': False, 'message': 'Not your turn'})
+                return
 
-                session.game.new_round()
-            else:
-                session.game.betting_round()
+            action, amount = data.get('action'), data.get('amount')
+            try:
+                if action not in ACTIONS:
+                    raise ValueError(f"Unknown action: {action}")
+                if amount is not None:
+                    try:
+                        amount = int(amount)
+                    except (TypeError, ValueError):
+                        raise ValueError("Amount must be a number")
+                    if not 0 <= amount <= player.chips:
+                        raise ValueError(f"Amount must be between 0-{player.chips}")
+                session.apply(player, action, amount)
+            except ValueError as e:
+                send('action_result', {'success': False, 'message': str(e)})
+                return
+            # Let the AI seats play up to the next human turn
+            drive_ai(session)
 
-        emit('game_update', session.get_game_state(), room=game_id)
+# tournament_id -> sid of the client that started it, while it streams.
+# Tournament ids have their own form so that watch_tournament can never
+# join a client to a sid's personal room or a table's room.
+TOURNAMENT_ID = re.compile(r'tournament-[0-9a-f]{32}')
+running_tournaments = {}
+tournaments_lock = RLock()
+
+def stream_tournament(tournament_id, tournament):
+    ## Background task: play the tournament in slices, emitting the events
+    ## of each slice to the tournament's room, then the final standings
+    try:
+        for events in tournament.stream(TOURNAMENT_SLICE_STEPS):
+            send('tournament_update', {
+                'tournament_id': tournament_id,
+                'events': events,
+                'stats': tournament.stats(),
+            }, to=tournament_id)
+            socketio.sleep(0)
+        send('tournament_result', {
+            'tournament_id': tournament_id,
+            'stats': tournament.stats(),
+            'standings': [[place, name] for place, name in tournament.standings()],
+        }, to=tournament_id)
+    finally:
+        with tournaments_lock:
+            running_tournaments.pop(tournament_id, None)
+
+def bounded_int(data, key, default, low, high, what):
+    value = int(data.get(key, default))
+    if not low <= value <= high:
+        raise ValueError(f"{what} must be between {low}-{high}")
+    return value
+
+@socketio.on('start_tournament')
+@timed('start_tournament')
+def handle_start_tournament(data):
+    try:
+        entrants = bounded_int(data, 'entrants', 90, 2, MAX_TOURNAMENT_ENTRANTS, "Entrants")
+        seats = bounded_int(data, 'seats', 9, 2, 10, "Seats per table")
+        starting_chips = bounded_int(data, 'starting_chips', 1500, 100, MAX_TOURNAMENT_CHIPS,
+                                     "Starting chips")
+        hands_per_level = bounded_int(data, 'hands_per_level', 10, 1,
+                                      MAX_TOURNAMENT_HANDS_PER_LEVEL, "Hands per level")
+        ai_levels = [int(level) for level in data.get('ai_levels', [1])]
+        if not ai_levels or any(level not in (1, 2, 3) for level in ai_levels):
+            raise ValueError("AI levels must be 1, 2 or 3")
+        tournament = Tournament(entrants, seats, starting_chips, hands_per_level=hands_per_level,
+                                ai_levels=ai_levels, seed=int(data.get('seed', 0)))
+
+        tournament_id = f"tournament-{uuid.uuid4().hex}"
+        with tournaments_lock:
+            if len(running_tournaments) >= MAX_RUNNING_TOURNAMENTS:
+                raise ValueError("Too many tournaments running, try again later")
+            if sum(sid == request.sid for sid in running_tournaments.values()) \
+                    >= MAX_TOURNAMENTS_PER_SID:
+                raise ValueError("Your last tournament is still running")
+            running_tournaments[tournament_id] = request.sid
+        join_room(tournament_id)
+        send('tournament_started', {'tournament_id': tournament_id, 'stats': tournament.stats()})
+        socketio.start_background_task(stream_tournament, tournament_id, tournament)
+    except Exception as e:
+        send('error', {'message': str(e)})
+
+@socketio.on('watch_tournament')
+@timed('watch_tournament')
+def handle_watch_tournament(data):
+    ## Follow a tournament's updates and result. Its room is broadcast to
+    ## through the message queue, so any worker can take watchers; only
+    ## ids minted by start_tournament are accepted.
+    tournament_id = data.get('tournament_id') if isinstance(data, dict) else None
+    if not isinstance(tournament_id, str) or not TOURNAMENT_ID.fullmatch(tournament_id):
+        send('error', {'message': 'Tournament not found'})
+        return
+    join_room(tournament_id)
+
+@socketio.on('rejoin_game')
+@timed('rejoin_game')
+def handle_rejoin_game(data):
+    ## A client back after a dropped connection takes its seat again with
+    ## the token from its first full snapshot and gets only the events it
+    ## missed. A missing seq (a reloaded page) or one that is not a version
+    ## number gets a full resync.
+    game_id = game_id_of(data)
+    if game_id is None:
+        send('error', {'message': 'Seat not found'})
+        return
+    seq = data.get('seq')
+    if not is_version(seq):
+        seq = None
+    if served_elsewhere(game_id):
+        return
+    with games.locked(game_id) as session:
+        player = session and next((p for p in session.players
+                                   if data.get('token') and getattr(p, 'token', None) == data['token']), None)
+        if player is None:
+            send('error', {'message': 'Seat not found'})
+            return
+        join_room(game_id)
+        send('game_update', session.resume(player, request.sid, seq))
+
+@socketio.on('ack_state')
+@timed('ack_state')
+def handle_ack_state(data):
+    # Acks never wake a hibernated table. Malformed acks are dropped, the
+    # client resyncs if it really has fallen behind.
+    game_id = game_id_of(data)
+    if game_id is None or not is_version(data.get('version')):
+        return
+    session = games.peek(game_id)
+    if session:
+        session.acknowledge(request.sid, data['version'])
+
+@socketio.on('resync')
+@timed('resync')
+def handle_resync(data):
+    ## Client lost track of the version chain: send it a full snapshot
+    game_id = game_id_of(data)
+    if game_id is None:
+        send('error', {'message': 'Game not found'})
+        return
+    if served_elsewhere(game_id):
+        return
+    with games.locked(game_id) as session:
+        if session:
+            send('game_update', session.snapshot(request.sid))
 
 if __name__ == '__main__':
-    socketio.run(app, debug=True)
\ No newline at end of file
+    socketio.start_background_task(sweep_idle_tables)
+    # No reloader in multi-process mode, it would fork every worker again.
+    # Workers started by cluster.py or loadtest.py have no terminal, which
+    # Flask-SocketIO otherwise takes for a production deployment.
+    socketio.run(app, host=os.environ.get('POKER_HOST', '127.0.0.1'),
+                 port=int(os.environ.get('POKER_PORT', 5000)), debug=not WORKER_URLS,
+                 allow_unsafe_werkzeug=True)
\ No newline at end of file
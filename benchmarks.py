@@ -0,0 +1,465 @@
+# benchmarks.py
+# Reproducible benchmarks for poker_logic and app with JSON results that
+# can be compared across commits.
+#
+#     python benchmarks.py                         # run everything
+#     python benchmarks.py -k evaluate -o before.json
+#     python benchmarks.py -o after.json --compare before.json
+#
+# A benchmark is a function taking a seed and returning a run() callable.
+# Inputs are built from the seed before timing starts. run() does the
+# timed work and returns how many operations it performed. Each benchmark
+# is run `repeat` times and the median and best rates are reported.
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+from poker_logic import CARDS, GamePhase, HandEvaluator, Player, PokerGame
+
+BENCHMARKS = {}
+
+
+def benchmark(name, group):
+    def register(fn):
+        BENCHMARKS[name] = (group, fn)
+        return fn
+    return register
+
+
+def _hands(rng, count, size):
+    return [rng.sample(CARDS, size) for _ in range(count)]
+
+
+@benchmark('evaluate_hand', 'micro')
+def bench_evaluate_hand(seed):
+    hands = _hands(random.Random(seed), 20000, 7)
+
+    def run():
+        for hand in hands:
+            HandEvaluator.evaluate_hand(hand[:2], hand[2:])
+        return len(hands)
+    return run
+
+
+@benchmark('evaluate_hand_brute_force', 'micro')
+def bench_evaluate_brute_force(seed):
+    hands = _hands(random.Random(seed), 500, 7)
+
+    def run():
+        for hand in hands:
+            HandEvaluator._evaluate_brute_force(hand)
+        return len(hands)
+    return run
+
+
+@benchmark('evaluate_combo', 'micro')
+def bench_evaluate_combo(seed):
+    combos = _hands(random.Random(seed), 20000, 5)
+
+    def run():
+        for combo in combos:
+            HandEvaluator._evaluate_combo(combo)
+        return len(combos)
+    return run
+
+
+@benchmark('evaluate_many', 'micro')
+def bench_evaluate_many(seed):
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    cards = np.argsort(rng.random((200000, 52)), axis=1)[:, :7]
+
+    def run():
+        HandEvaluator.evaluate_many(cards[:, :2], cards[:, 2:])
+        return len(cards)
+    return run
+
+
+@benchmark('range_equity', 'micro')
+def bench_range_equity(seed):
+    ## Combos evaluated per second for "JJ+,AKs" vs "22+,A2s+" preflop
+    import ranges
+    hero, villain = ranges.parse_range('JJ+,AKs'), ranges.parse_range('22+,A2s+')
+
+    def run():
+        return ranges.range_equity(hero, villain, samples=2000, seed=seed).evaluations
+    return run
+
+
+@benchmark('new_deck', 'micro')
+def bench_new_deck(seed):
+    game = PokerGame([Player('A'), Player('B')], seed=seed, headless=True)
+
+    def run():
+        for _ in range(10000):
+            game.new_deck()
+        return 10000
+    return run
+
+
+@benchmark('deal_6max_full_shuffle', 'micro')
+def bench_deal_full_shuffle(seed):
+    ## Dealing a 6-max hand the way new_deck used to: a fresh 52 card list
+    ## fully shuffled every hand
+    rng = random.Random(seed)
+
+    def run():
+        for _ in range(10000):
+            deck = list(CARDS)
+            rng.shuffle(deck)
+            for _ in range(17):
+                deck.pop()
+        return 10000
+    return run
+
+
+@benchmark('deal_6max', 'micro')
+def bench_deal(seed):
+    game = PokerGame([Player(f"P{i}") for i in range(6)], seed=seed, headless=True)
+
+    def run():
+        for _ in range(10000):
+            game.new_deck(17)
+            deck = game.deck
+            for _ in range(17):
+                deck.pop()
+        return 10000
+    return run
+
+
+@benchmark('determine_winners', 'micro')
+def bench_determine_winners(seed):
+    rng = random.Random(seed)
+    games = []
+    for _ in range(2000):
+        players = [Player(f"P{i}") for i in range(6)]
+        game = PokerGame(players, rng=rng, headless=True)
+        game.start_hand()
+        game.deal_community_cards(5)
+        games.append(game)
+
+    def run():
+        for game in games:
+            game.determine_winners()
+        return len(games)
+    return run
+
+
+def _all_in_showdowns(rng, count, seats):
+    ## Hands where every seat shoves a different stack preflop, leaving one
+    ## side pot per distinct stack, ready for showdown()
+    games = []
+    for _ in range(count):
+        players = [Player(f"P{i}", chips=rng.randrange(50, 2000)) for i in range(seats)]
+        game = PokerGame(players, rng=rng, headless=True)
+        game.start_hand(max_raises=seats)
+        while game.current_phase != GamePhase.SHOWDOWN:
+            if game.street_complete:
+                game.next_street()
+            else:
+                game.apply_action(game.current_player, 'raise', game.current_player.chips)
+        games.append(game)
+    return games
+
+
+@benchmark('showdown_10way_all_in', 'micro')
+def bench_showdown_all_in(seed):
+    ## Each live hand may be evaluated at most once however many side pots
+    ## there are (none at all once trackers have ranked them while dealing)
+    ## and every chip must be paid out. Checked before timing.
+    import hand_evaluator
+    games = _all_in_showdowns(random.Random(seed), 1000, 10)
+    evaluate_key = hand_evaluator.evaluate_key
+    calls = [0]
+
+    def counting(key, mask):
+        calls[0] += 1
+        return evaluate_key(key, mask)
+    hand_evaluator.evaluate_key = counting
+    try:
+        for game in games:
+            calls[0] = 0
+            side_pots, payouts = game.showdown()
+            if calls[0] > 10:
+                raise AssertionError(f"{calls[0]} evaluator calls for 10 live hands")
+            if sum(payouts.values()) != game.pot or sum(p.amount for p in side_pots) != game.pot:
+                raise AssertionError("side pots do not add up to the pot")
+    finally:
+        hand_evaluator.evaluate_key = evaluate_key
+
+    def run():
+        for game in games:
+            game.showdown()
+        return len(games)
+    return run
+
+
+@benchmark('hands_6max_level1', 'macro')
+def bench_hands_level1(seed):
+    from simulation import run_table
+
+    def run():
+        return run_table([1] * 6, 2000, seed).hands
+    return run
+
+
+@benchmark('hands_3max_level2', 'macro')
+def bench_hands_level2(seed):
+    import equity_cache
+    from simulation import run_table
+
+    def run():
+        equity_cache.cache.clear()
+        return run_table([2, 2, 1], 100, seed).hands
+    return run
+
+
+@benchmark('tournament_90', 'macro')
+def bench_tournament_small(seed):
+    from tournament import Tournament
+
+    def run():
+        return Tournament(90, seed=seed).run().hands_played
+    return run
+
+
+@benchmark('tournament_900', 'macro')
+def bench_tournament(seed):
+    from tournament import Tournament
+
+    def run():
+        return Tournament(900, seed=seed).run().hands_played
+    return run
+
+
+def _scheduler_overhead(tasks):
+    ## Task switches per second with `tasks` tables that do no work, the
+    ## cost the tournament scheduler adds to every action
+    from tournament import Scheduler
+
+    def idle():
+        while True:
+            yield
+
+    def run():
+        scheduler = Scheduler()
+        for _ in range(tasks):
+            scheduler.spawn(idle())
+        scheduler.run(200000)
+        return scheduler.switches
+    return run
+
+
+for _tasks in (100, 1000, 10000):
+    benchmark(f'scheduler_{_tasks}_tables', 'micro')(
+        lambda seed, tasks=_tasks: _scheduler_overhead(tasks))
+
+
+def _socket_client():
+    import app
+    return app, app.socketio.test_client(app.app)
+
+
+def _wait_for(client, event, timeout=10):
+    ## AI seats play on the executor, so updates may arrive after emit returns
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        for packet in client.get_received():
+            if packet['name'] == event:
+                return packet['args'][0]
+        time.sleep(0.0002)
+    raise AssertionError(f"no {event} within {timeout}s")
+
+
+def _create_and_join(client, num_ai=3):
+    client.emit('create_game', {'num_ai': num_ai})
+    game_id = client.get_received()[0]['args'][0]['game_id']
+    client.emit('join_game', {'game_id': game_id, 'name': 'Bench'})
+    _wait_for(client, 'game_update')
+    return game_id
+
+
+@benchmark('socket_create_game', 'socket')
+def bench_create_game(seed):
+    app, client = _socket_client()
+
+    def run():
+        random.seed(seed)
+        for _ in range(200):
+            client.emit('create_game', {'num_ai': 5})
+            client.get_received()
+        return 200
+    return run
+
+
+@benchmark('socket_join_game', 'socket')
+def bench_join_game(seed):
+    app, client = _socket_client()
+
+    def run():
+        random.seed(seed)
+        for _ in range(200):
+            _create_and_join(client, 5)
+        return 200
+    return run
+
+
+@benchmark('socket_player_action', 'socket')
+def bench_player_action(seed):
+    app, client = _socket_client()
+
+    def run():
+        random.seed(seed)
+        game_id = _create_and_join(client, 5)
+        for _ in range(500):
+            game = app.games[game_id].game
+            if game.current_player is None or game.current_player.ai_level > 0:
+                game_id = _create_and_join(client, 5)
+            client.emit('player_action', {'game_id': game_id, 'action': 'call'})
+            _wait_for(client, 'game_update')
+        return 500
+    return run
+
+
+@benchmark('registry_contention', 'concurrency')
+def bench_registry_contention(seed):
+    ## 64 tables driven from 16 threads through a GameRegistry while another
+    ## thread holds one table's lock for the whole run. Every worker must
+    ## finish anyway: no table may wait on another table's lock.
+    import threading
+    from app import GameSession
+    from registry import GameRegistry
+
+    random.seed(seed)
+    registry = GameRegistry()
+    for i in range(65):
+        session = GameSession(f"table-{i}", 5)
+        session.players.append(Player("Human", ai_level=0))
+        session.start_game()
+        registry.add(session.game_id, session)
+    held = registry.get("table-64")
+    table_ids = [f"table-{i}" for i in range(64)]
+
+    def work(ids, ops, counts, index):
+        done = 0
+        while done < ops:
+            for game_id in ids:
+                session = registry.get(game_id)
+                with session.lock:
+                    human = session.players[0]
+                    if session.game.current_player is human:
+                        session.game.apply_action(human, 'call')
+                    else:
+                        session.start_game()
+                    session.run_ai()
+                    session.get_game_state(human)
+                done += 1
+        counts[index] = done
+
+    def run():
+        threads_count = 16
+        counts = [0] * threads_count
+        holder_ready, release = threading.Event(), threading.Event()
+
+        def hold():
+            with held.lock:
+                holder_ready.set()
+                release.wait()
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        holder_ready.wait()
+        workers = [threading.Thread(target=work, args=(table_ids[i::threads_count], 200, counts, i))
+                   for i in range(threads_count)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(timeout=120)
+        stuck = any(worker.is_alive() for worker in workers)
+        release.set()
+        holder.join()
+        if stuck:
+            raise AssertionError("table work blocked behind another table's lock")
+        return sum(counts)
+    return run
+
+
+def run_benchmark(name, seed=0, repeat=5):
+    group, fn = BENCHMARKS[name]
+    run = fn(seed)
+    rates = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ops = run()
+        rates.append(ops / (time.perf_counter() - start))
+    median = statistics.median(rates)
+    return {
+        'group': group,
+        'ops': ops,
+        'repeat': repeat,
+        'median_ops_per_sec': median,
+        'best_ops_per_sec': max(rates),
+        'median_us_per_op': 1e6 / median,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run pyPoker benchmarks')
+    parser.add_argument('-k', '--filter', default='', help='only names containing this')
+    parser.add_argument('-g', '--group', choices=['micro', 'macro', 'socket', 'concurrency'])
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', help='write JSON results here')
+    parser.add_argument('--compare', help='JSON results of an earlier run')
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+
+    results = {}
+    for name, (group, _) in BENCHMARKS.items():
+        if args.filter not in name or (args.group and group != args.group):
+            continue
+        try:
+            results[name] = result = run_benchmark(name, args.seed, args.repeat)
+        except ImportError as e:
+            print(f"{name:<28} skipped ({e})")
+            continue
+        line = f"{name:<28} {result['median_ops_per_sec']:>14,.0f} ops/s {result['median_us_per_op']:>12.2f} us/op"
+        if name in baseline:
+            line += f"  x{result['median_ops_per_sec'] / baseline[name]['median_ops_per_sec']:.2f}"
+        print(line)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'meta': {
+                    'commit': _git_commit(),
+                    'python': sys.version.split()[0],
+                    'platform': platform.platform(),
+                    'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'seed': args.seed,
+                },
+                'results': results,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,356 @@
+# cluster.py
+# Serving tables from several worker processes.
+#
+# Every table belongs to exactly one worker: table_owner(game_id, workers)
+# hashes the id, so any process can tell who owns a table without asking.
+# Workers mint ids they own for new tables and redirect clients of other
+# tables to the owner (see app.owner_url). Table state goes to the store named
+# by POKER_TABLE_STORE; with a shared SQLite file a table survives its
+# worker and can be picked up by whichever worker owns it next.
+#
+# Broadcasts reach clients on other workers through Flask-SocketIO's
+# message queue (POKER_MESSAGE_QUEUE, e.g. redis://localhost:6379/0).
+# LocalPubSubManager stands in for one without external services: 'local'
+# wires together SocketIO servers inside a single process, and
+# 'local://host:port' connects worker processes on one machine through a
+# QueueHub, which `serve --message-queue local` starts for its workers.
+#
+#     python cluster.py serve --workers 4 --port 5001 --store sqlite:///tables.db
+#     python cluster.py scale --workers 1 2 4
+#     python cluster.py check
+
+import argparse
+import asyncio
+import http.client
+import json
+import multiprocessing
+import os
+import queue
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from multiprocessing.connection import Client, Listener
+from urllib.parse import urlsplit
+
+import socketio
+
+
+def table_owner(game_id, workers):
+    ## Index of the worker that serves game_id; stable across processes,
+    ## unlike hash() of a str
+    return zlib.crc32(game_id.encode()) % workers
+
+
+class LocalPubSubManager(socketio.PubSubManager):
+    ## Message queue without external services. With url 'local', managers
+    ## on the same channel in this process see each other's messages; with
+    ## 'local://host:port' they go through the QueueHub listening there, so
+    ## worker processes see each other's messages as with Redis
+    name = 'local'
+    _channels = {}
+    _channels_lock = threading.Lock()
+
+    def __init__(self, channel='socketio', write_only=False, logger=None, url='local'):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self._hub = None
+        if url != 'local':
+            address = urlsplit(url)
+            self._hub = Client((address.hostname, address.port))
+            self._hub.send_bytes(b'write' if write_only else b'listen')
+            self._hub_lock = threading.Lock()
+            return
+        self._queue = queue.Queue()
+        if not write_only:
+            with self._channels_lock:
+                self._channels.setdefault(channel, []).append(self._queue)
+
+    def _publish(self, data):
+        message = json.dumps(data)
+        if self._hub is not None:
+            with self._hub_lock:
+                self._hub.send_bytes(f"{self.channel}\n{message}".encode())
+            return
+        with self._channels_lock:
+            subscribers = list(self._channels.get(self.channel, ()))
+        for subscriber in subscribers:
+            subscriber.put(message)
+
+    def _listen(self):
+        if self._hub is not None:
+            while True:
+                channel, _, message = self._hub.recv_bytes().decode().partition('\n')
+                if channel == self.channel:
+                    yield message
+        while True:
+            yield self._queue.get()
+
+
+class QueueHub:
+    ## Relays LocalPubSubManager messages between processes: whatever one
+    ## connection publishes goes to every listening connection, the sender
+    ## included, as on a Redis channel. Bound to localhost by default.
+    def __init__(self, host='127.0.0.1', port=0):
+        self._listener = Listener((host, port))
+        self.url = 'local://%s:%d' % self._listener.address
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        threading.Thread(target=self._accept, daemon=True).start()
+        return self
+
+    def _accept(self):
+        while True:
+            try:
+                connection = self._listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._relay, args=(connection,), daemon=True).start()
+
+    def _relay(self, connection):
+        try:
+            if connection.recv_bytes() == b'listen':
+                with self._lock:
+                    self._listeners.append(connection)
+            while True:
+                message = connection.recv_bytes()
+                with self._lock:
+                    for listener in self._listeners:
+                        try:
+                            listener.send_bytes(message)
+                        except OSError:
+                            pass
+        except (EOFError, OSError):
+            pass
+        finally:
+            with self._lock:
+                if connection in self._listeners:
+                    self._listeners.remove(connection)
+            connection.close()
+
+    def close(self):
+        self._listener.close()
+
+
+def worker_env(index, urls, store=None, message_queue=None):
+    ## Environment that makes app.py serve as worker `index` of `urls`
+    env = dict(os.environ, POKER_WORKERS=','.join(urls), POKER_WORKER_INDEX=str(index))
+    if store:
+        env['POKER_TABLE_STORE'] = store
+    if message_queue:
+        env['POKER_MESSAGE_QUEUE'] = message_queue
+    return env
+
+
+def start_worker(index, urls, store=None, message_queue=None, quiet=False):
+    ## Run app.py as worker `index` of `urls`, listening on urls[index]
+    address = urlsplit(urls[index])
+    env = worker_env(index, urls, store, message_queue)
+    env['POKER_HOST'] = address.hostname
+    env['POKER_PORT'] = str(address.port)
+    app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+    output = subprocess.DEVNULL if quiet else None
+    return subprocess.Popen([sys.executable, app_path], env=env, stdout=output, stderr=output)
+
+
+def wait_listening(process, url, timeout=30.0):
+    ## Block until the worker at url accepts connections
+    address = urlsplit(url)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Worker {url} exited with code {process.returncode}")
+        try:
+            socket.create_connection((address.hostname, address.port), timeout=1.0).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Worker {url} did not start listening")
+
+
+def serve(workers, host='127.0.0.1', port=5001, store=None, message_queue=None):
+    ## Run app.py once per worker on consecutive ports until interrupted.
+    ## message_queue 'local' starts a QueueHub in this process for them.
+    urls = [f"http://{host}:{port + i}" for i in range(workers)]
+    if message_queue == 'local':
+        message_queue = QueueHub(host).start().url
+    processes = [start_worker(index, urls, store, message_queue) for index in range(workers)]
+    print('Workers: ' + ', '.join(urls))
+    try:
+        for process in processes:
+            process.wait()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+
+
+def _scale_worker(index, workers, store_url, tables, actions, start, results):
+    ## Drive the tables this worker owns, writing each one through to the
+    ## shared store after every action, the way a worker process serves them
+    os.environ['POKER_AI_WORKERS'] = '0'
+    import random
+    from app import GameSession
+    from poker_logic import Player
+    from registry import GameRegistry
+    from table_store import open_store
+
+    random.seed(index)
+    registry = GameRegistry(restore=GameSession.from_snapshot, store=open_store(store_url))
+    owned = [f"table-{i}" for i in range(tables) if table_owner(f"table-{i}", workers) == index]
+    for game_id in owned:
+        session = GameSession(game_id, 5)
+        session.players.append(Player("Human", ai_level=0))
+        session.players[0].sid = f"sid-{game_id}"
+        session.start_game()
+        session.run_ai()
+        registry.add(game_id, session)
+    start.wait()
+
+    began = time.perf_counter()
+    done = 0
+    while done < actions and owned:
+        for game_id in owned:
+            with registry.locked(game_id) as session:
+                human = session.players[0]
+                if session.game.current_player is human:
+                    session.apply(human, 'call')
+                else:
+                    session.start_game()
+                session.run_ai()
+                session.publish()
+            done += 1
+    results.put((index, done, time.perf_counter() - began))
+
+
+def measure(workers, tables=64, actions=2000, store_url=None):
+    ## Table actions per second with `workers` processes sharing one store.
+    ## `actions` is the total, split evenly over the workers.
+    ctx = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as directory:
+        store_url = store_url or f"sqlite:///{os.path.join(directory, 'tables.db')}"
+        # Timing starts once every worker has set up its tables
+        start, results = ctx.Barrier(workers + 1), ctx.Queue()
+        processes = [ctx.Process(target=_scale_worker,
+                                 args=(i, workers, store_url, tables, actions // workers,
+                                       start, results))
+                     for i in range(workers)]
+        for process in processes:
+            process.start()
+        start.wait()
+        reports = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+    done = sum(report[1] for report in reports)
+    return done / max(report[2] for report in reports)
+
+
+def check_scaling(worker_counts=(1, 2, 4), tables=64, actions=2000):
+    ## Throughput must rise with the worker count, as far as there are
+    ## cores to run the workers on. Returns {workers: actions per second}.
+    rates = {workers: measure(workers, tables, actions) for workers in worker_counts}
+    cores = os.cpu_count() or 1
+    previous = None
+    for workers in sorted(rates):
+        if previous is not None and min(workers, cores) > min(previous, cores) \
+                and rates[workers] <= rates[previous]:
+            raise AssertionError(f"{workers} workers are no faster than {previous}: {rates}")
+        previous = workers
+    return rates
+
+
+def _free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+async def _check_clients(urls, timeout):
+    from loadtest import SocketIOClient
+
+    async def connect(url):
+        address = urlsplit(url)
+        client = SocketIOClient(address.hostname, address.port)
+        await client.connect(timeout)
+        return client
+
+    first, second = await connect(urls[0]), await connect(urls[1])
+    try:
+        # A tournament runs on the first worker and broadcasts to its room;
+        # a client of the second worker watching it must get the result
+        first.emit('start_tournament', {'entrants': 90, 'seed': 1})
+        _, started = await first.receive({'tournament_started', 'error'}, timeout)
+        if 'tournament_id' not in started:
+            raise AssertionError(f"Tournament did not start: {started}")
+        second.emit('watch_tournament', {'tournament_id': started['tournament_id']})
+        _, local = await first.receive({'tournament_result'}, timeout)
+        _, remote = await second.receive({'tournament_result'}, timeout)
+        if remote != local:
+            raise AssertionError("The other worker's client got a different tournament result")
+
+        # Joining a table the first worker owns through the second redirects
+        game_id = next(f"table-{i}" for i in range(100) if table_owner(f"table-{i}", 2) == 0)
+        second.emit('join_game', {'game_id': game_id, 'name': 'Check'})
+        _, error = await second.receive({'error', 'game_update'}, timeout)
+        if error.get('redirect') != f"{urls[0]}/game/{game_id}":
+            raise AssertionError(f"join_game was not redirected to the owner: {error}")
+        return game_id
+    finally:
+        await first.close()
+        await second.close()
+
+
+def check_workers(timeout=30.0):
+    ## Two app.py worker processes joined by a QueueHub: a room broadcast
+    ## from one reaches a client of the other, and tables of one are
+    ## redirected to it by the other, over Socket.IO and HTTP
+    hub = QueueHub().start()
+    urls = [f"http://127.0.0.1:{_free_port()}" for _ in range(2)]
+    processes = [start_worker(index, urls, message_queue=hub.url, quiet=True) for index in range(2)]
+    try:
+        for process, url in zip(processes, urls):
+            wait_listening(process, url, timeout)
+        game_id = asyncio.run(_check_clients(urls, timeout))
+        address = urlsplit(urls[1])
+        connection = http.client.HTTPConnection(address.hostname, address.port, timeout=timeout)
+        connection.request('GET', f"/game/{game_id}")
+        response = connection.getresponse()
+        if response.status != 302 or response.getheader('Location') != f"{urls[0]}/game/{game_id}":
+            raise AssertionError(f"/game/{game_id} was not redirected to the owner: {response.status}")
+        connection.close()
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+        hub.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Multi-process table serving')
+    sub = parser.add_subparsers(dest='command', required=True)
+    run = sub.add_parser('serve')
+    run.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    run.add_argument('--host', default='127.0.0.1')
+    run.add_argument('--port', type=int, default=5001)
+    run.add_argument('--store', help='e.g. sqlite:///tables.db, in memory per worker by default')
+    run.add_argument('--message-queue',
+                     help="e.g. redis://localhost:6379/0, or local to relay between these workers")
+    scale = sub.add_parser('scale')
+    scale.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    scale.add_argument('--tables', type=int, default=64)
+    scale.add_argument('--actions', type=int, default=2000)
+    sub.add_parser('check')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        serve(args.workers, args.host, args.port, args.store, args.message_queue)
+    elif args.command == 'check':
+        check_workers()
+        print('ok')
+    else:
+        print(f"{os.cpu_count()} cores")
+        for workers, rate in check_scaling(args.workers, args.tables, args.actions).items():
+            print(f"{workers} workers: {rate:,.0f} actions/s")
@@ -0,0 +1,179 @@
+# equity.py
+# Monte Carlo win/tie equity on top of hand_evaluator.
+#
+# Sampling is split into fixed size batches. Batch i always uses the seed
+# derived from (seed, i) and batches are folded into the totals in index
+# order, so a given seed gives the same answer whether the batches run
+# in-process or on any number of worker processes, early stopping included.
+# run_batches() does that scheduling for every batched Monte Carlo job in
+# the repo (ranges.range_equity and strategy_table.equity_matrix too).
+
+import math
+import random
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+
+import hand_evaluator
+from hand_evaluator import _RANK_KEY, evaluate_key
+
+_Z95 = 1.96
+
+
+class EquityResult:
+    def __init__(self, wins, ties, equity_sum, equity_sq_sum, samples, elapsed, seed):
+        self.samples = samples
+        self.win = wins / samples if samples else 0.0
+        self.tie = ties / samples if samples else 0.0
+        self.equity = equity_sum / samples if samples else 0.0
+        variance = equity_sq_sum / samples - self.equity ** 2 if samples else 0.0
+        self.stderr = math.sqrt(max(variance, 0.0) / samples) if samples else float('inf')
+        self.elapsed = elapsed
+        self.samples_per_sec = samples / elapsed if elapsed > 0 else float('inf')
+        self.seed = seed
+
+    @property
+    def margin(self):
+        ## Half width of the 95% confidence interval on equity
+        return _Z95 * self.stderr
+
+    def __repr__(self):
+        return (f"EquityResult(equity={self.equity:.4f} ±{self.margin:.4f}, win={self.win:.4f}, "
+                f"tie={self.tie:.4f}, samples={self.samples}, {self.samples_per_sec:.0f} samples/s)")
+
+
+def card_ids(cards):
+    ## Accept Card objects or plain card ids
+    return [c if isinstance(c, int) else c.id for c in cards]
+
+
+def batch_seed(seed, index):
+    return (seed << 32) ^ index
+
+
+def run_batches(fn, jobs, seed, workers=1):
+    ## Yield fn(*job, batch_seed(seed, i)) for the i-th job, in job order,
+    ## either in-process or on a pool of `workers` processes that keeps at
+    ## most 2 * workers batches in flight. fn must be a module level
+    ## function so the pool can pickle it. Closing the generator early
+    ## cancels the batches not yet started.
+    if workers <= 1 or len(jobs) <= 1:
+        for index, job in enumerate(jobs):
+            yield fn(*job, batch_seed(seed, index))
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        next_index = 0
+        try:
+            while next_index < len(jobs) or pending:
+                while next_index < len(jobs) and len(pending) < 2 * workers:
+                    pending.append(pool.submit(fn, *jobs[next_index], batch_seed(seed, next_index)))
+                    next_index += 1
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def sample_batch(hole, board, num_opponents, count, seed):
+    ## Play out `count` random run-outs; returns
+    ## (wins, ties, equity_sum, equity_sq_sum)
+    rng = random.Random(seed)
+    known = set(hole) | set(board)
+    deck = [c for c in range(52) if c not in known]
+    missing = 5 - len(board)
+    needed = missing + 2 * num_opponents
+
+    board_key = sum(_RANK_KEY[c] for c in board)
+    board_mask = 0
+    for c in board:
+        board_mask |= 1 << c
+    hole_key = _RANK_KEY[hole[0]] + _RANK_KEY[hole[1]]
+    hole_mask = (1 << hole[0]) | (1 << hole[1])
+
+    wins = ties = 0
+    equity_sum = equity_sq_sum = 0.0
+    for _ in range(count):
+        drawn = rng.sample(deck, needed)
+        key, mask = board_key, board_mask
+        for c in drawn[:missing]:
+            key += _RANK_KEY[c]
+            mask |= 1 << c
+        hero = evaluate_key(key + hole_key, mask | hole_mask)
+
+        best_other = 0
+        tied = 0
+        for i in range(missing, needed, 2):
+            a, b = drawn[i], drawn[i + 1]
+            value = evaluate_key(key + _RANK_KEY[a] + _RANK_KEY[b], mask | (1 << a) | (1 << b))
+            if value > best_other:
+                best_other = value
+            if value == hero:
+                tied += 1
+
+        if hero > best_other:
+            wins += 1
+            equity_sum += 1.0
+            equity_sq_sum += 1.0
+        elif hero == best_other:
+            ties += 1
+            share = 1.0 / (tied + 1)
+            equity_sum += share
+            equity_sq_sum += share * share
+    return wins, ties, equity_sum, equity_sq_sum
+
+
+def equity(hole_cards, board=(), num_opponents=1, samples=100000, workers=1, seed=None,
+           target_margin=None, batch_size=2000, min_samples=2000):
+    ## Estimate hero equity against `num_opponents` random hands.
+    ## workers > 1 spreads batches over a ProcessPoolExecutor. With
+    ## target_margin set, sampling stops once the 95% confidence half width
+    ## on equity drops below it (checked after every batch, min_samples first).
+    hole = card_ids(hole_cards)
+    board = card_ids(board)
+    if len(hole) != 2:
+        raise ValueError("Need exactly 2 hole cards")
+    if len(board) > 5:
+        raise ValueError("Board has at most 5 cards")
+    if len(set(hole + board)) != len(hole) + len(board):
+        raise ValueError("Duplicate cards")
+    if not 1 <= num_opponents <= 9:
+        raise ValueError("Opponents must be between 1-9")
+    if seed is None:
+        seed = random.getrandbits(32)
+
+    num_batches = max(1, math.ceil(samples / batch_size))
+    sizes = [min(batch_size, samples - i * batch_size) for i in range(num_batches)]
+    totals = [0, 0, 0.0, 0.0]
+    done = 0
+    start = time.perf_counter()
+
+    def finished():
+        if target_margin is None or done < min_samples:
+            return False
+        result = EquityResult(*totals, done, 1.0, seed)
+        return result.margin <= target_margin
+
+    def add(batch, size):
+        nonlocal done
+        for i, value in enumerate(batch):
+            totals[i] += value
+        done += size
+
+    jobs = [(hole, board, num_opponents, size) for size in sizes]
+    with closing(run_batches(sample_batch, jobs, seed, workers)) as batches:
+        for size, batch in zip(sizes, batches):
+            add(batch, size)
+            if finished():
+                break
+
+    return EquityResult(*totals, done, time.perf_counter() - start, seed)
+
+
+if __name__ == "__main__":
+    # A♠K♠ against two random hands, both ways, to show determinism and scaling
+    ace_king = [hand_evaluator.card_id(12, 3), hand_evaluator.card_id(11, 3)]
+    print(equity(ace_king, num_opponents=2, samples=200000, seed=1))
+    print(equity(ace_king, num_opponents=2, samples=200000, seed=1, workers=4))
+    print(equity(ace_king, num_opponents=2, samples=1000000, seed=1, workers=4, target_margin=0.005))
@@ -0,0 +1,125 @@
+# equity_cache.py
+# Suit-isomorphism canonicalization and a bounded LRU cache for equity
+# queries.
+#
+# Two (hole cards, board) situations that differ only by a relabelling of
+# suits have the same equity. For each suit we take a 26 bit signature,
+# hole ranks in the high 13 bits and board ranks in the low 13, and sort
+# the four signatures. The sorted signatures are the canonical key, and
+# rebuilding cards from them gives one representative per class.
+
+import threading
+from collections import OrderedDict
+
+import equity
+
+
+def canonical_key(hole_cards, board=()):
+    signatures = [0, 0, 0, 0]
+    for card in equity.card_ids(hole_cards):
+        suit, rank = divmod(card, 13)
+        signatures[suit] |= 1 << (rank + 13)
+    for card in equity.card_ids(board):
+        suit, rank = divmod(card, 13)
+        signatures[suit] |= 1 << rank
+    signatures.sort(reverse=True)
+    return (signatures[0] << 78) | (signatures[1] << 52) | (signatures[2] << 26) | signatures[3]
+
+
+def canonical_cards(key):
+    ## Representative (hole ids, board ids) of a canonical key
+    hole, board = [], []
+    for suit in range(4):
+        signature = (key >> (78 - 26 * suit)) & 0x3FFFFFF
+        for rank in range(13):
+            if signature >> (rank + 13) & 1:
+                hole.append(suit * 13 + rank)
+            if signature >> rank & 1:
+                board.append(suit * 13 + rank)
+    return hole, board
+
+
+class LRUCache:
+    def __init__(self, maxsize=50000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            self._evict()
+
+    def get_or_compute(self, key, compute):
+        ## compute() runs outside the lock, so two threads missing on the
+        ## same key may both compute it; the later result wins
+        sentinel = self._data  # never a cached value
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def resize(self, maxsize):
+        with self._lock:
+            self.maxsize = maxsize
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def _evict(self):
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+# Shared by every table in the process
+cache = LRUCache()
+
+
+def cached_equity(hole_cards, board, num_opponents, samples=400):
+    ## Equity through the cache. Misses are sampled on the canonical
+    ## representative with a seed taken from the key, so a key always maps
+    ## to the same answer whichever table asked first.
+    key = canonical_key(hole_cards, board)
+    cache_key = (key, num_opponents, samples)
+
+    def compute():
+        hole, canonical_board = canonical_cards(key)
+        seed = (key ^ (key >> 32) ^ (key >> 64) ^ num_opponents) & 0xFFFFFFFF
+        return equity.equity(hole, canonical_board, num_opponents=num_opponents,
+                             samples=samples, seed=seed).equity
+
+    return cache.get_or_compute(cache_key, compute)
@@ -0,0 +1,395 @@
+# hand_evaluator.py
+# Table driven 5/6/7 card evaluator.
+#
+# Cards are plain ints 0-51: id = suit_index * 13 + rank_index, where
+# rank_index 0 is a deuce and 12 an ace, and suit_index follows the order of
+# poker_logic.Suit. A hand is scored as a single int; bigger is better and
+# the ordering matches the (category, ranks, kickers) tuples produced by
+# HandEvaluator._evaluate_combo.
+#
+# Two tables are built once at import:
+#   _FLUSH   - 13 bit rank mask of one suit -> best flush / straight flush
+#   _NOFLUSH - base-5 rank count key        -> best non flush hand
+# Each card contributes 5**rank to the key, so the key of a hand is simply
+# the sum over its cards and the table needs no sorting at lookup time.
+
+import itertools
+import random
+
+try:
+    import numpy as np
+except ImportError:  # only evaluate_many needs numpy
+    np = None
+
+HIGH_CARD, PAIR, TWO_PAIR, TRIPS, STRAIGHT, FLUSH, FULL_HOUSE, QUADS, \
+    STRAIGHT_FLUSH, ROYAL_FLUSH = range(10)
+
+# How many of the encoded ranks are "ranks" (the rest are kickers), mirroring
+# the tuples of the brute force evaluator
+_PRIMARY_RANKS = (5, 1, 2, 1, 1, 5, 2, 1, 1, 5)
+
+_RANK_KEY = [5 ** (card % 13) for card in range(52)]
+_SUIT_SHIFTS = (0, 13, 26, 39)
+_WHEEL = 0x100F  # A, 2, 3, 4, 5
+
+
+def card_id(rank_index, suit_index):
+    return suit_index * 13 + rank_index
+
+
+def _encode(category, ranks):
+    value = category
+    for i in range(5):
+        value = (value << 4) | (ranks[i] if i < len(ranks) else 0)
+    return value
+
+
+def category(value):
+    return value >> 20
+
+
+def decode(value):
+    ## Split a strength back into (category, ranks, kickers)
+    cat = value >> 20
+    ranks = [(value >> shift) & 0xF for shift in (16, 12, 8, 4, 0)]
+    ranks = [r for r in ranks if r]
+    split = _PRIMARY_RANKS[cat]
+    return cat, ranks[:split], ranks[split:]
+
+
+def _straight_high(bits):
+    ## Highest rank (2-14) of a straight contained in a rank bit mask, or 0
+    for high in range(12, 3, -1):
+        window = 0x1F << (high - 4)
+        if bits & window == window:
+            return high + 2
+    if bits & _WHEEL == _WHEEL:
+        return 5
+    return 0
+
+
+def _build_flush_table():
+    table = [0] * 8192
+    for bits in range(8192):
+        if bin(bits).count("1") < 5:
+            continue
+        high = _straight_high(bits)
+        if high == 14:
+            table[bits] = _encode(ROYAL_FLUSH, [14, 13, 12, 11, 10])
+        elif high:
+            table[bits] = _encode(STRAIGHT_FLUSH, [high])
+        else:
+            ranks = [r + 2 for r in range(12, -1, -1) if bits >> r & 1][:5]
+            table[bits] = _encode(FLUSH, ranks)
+    return table
+
+
+def _best_rank_hand(counts):
+    ## Best non flush hand for a rank count vector (index 0 = deuce)
+    present, pairs, trips, quads = [], [], [], []
+    bits = 0
+    for r in range(12, -1, -1):
+        n = counts[r]
+        if n:
+            present.append(r + 2)
+            bits |= 1 << r
+            if n == 2:
+                pairs.append(r + 2)
+            elif n == 3:
+                trips.append(r + 2)
+            elif n == 4:
+                quads.append(r + 2)
+
+    if quads:
+        kicker = [r for r in present if r != quads[0]][:1]
+        return _encode(QUADS, [quads[0]] + kicker)
+    if trips and (len(trips) > 1 or pairs):
+        pair = max(trips[1:] + pairs)
+        return _encode(FULL_HOUSE, [trips[0], pair])
+    high = _straight_high(bits)
+    if high:
+        return _encode(STRAIGHT, [high])
+    if trips:
+        kickers = [r for r in present if r != trips[0]][:2]
+        return _encode(TRIPS, [trips[0]] + kickers)
+    if len(pairs) >= 2:
+        kicker = [r for r in present if r not in pairs[:2]][:1]
+        return _encode(TWO_PAIR, pairs[:2] + kicker)
+    if pairs:
+        kickers = [r for r in present if r != pairs[0]][:3]
+        return _encode(PAIR, [pairs[0]] + kickers)
+    return _encode(HIGH_CARD, present[:5])
+
+
+def _build_noflush_table():
+    table = {}
+    for total in (5, 6, 7):
+        for ranks in itertools.combinations_with_replacement(range(13), total):
+            counts = [0] * 13
+            for r in ranks:
+                counts[r] += 1
+            if max(counts) > 4:
+                continue
+            table[sum([_RANK_KEY[r] for r in ranks])] = _best_rank_hand(counts)
+    return table
+
+
+_FLUSH = _build_flush_table()
+_NOFLUSH = _build_noflush_table()
+
+
+def evaluate(cards):
+    ## Score 5, 6 or 7 distinct card ids; None for any other count.
+    ## Raises ValueError if a card appears twice.
+    key = 0
+    mask = 0
+    count = 0
+    for card in cards:
+        key += _RANK_KEY[card]
+        mask |= 1 << card
+        count += 1
+    if _popcount(mask) != count:
+        raise ValueError("Duplicate cards")
+    return evaluate_key(key, mask)
+
+
+def evaluate_mask(mask):
+    ## Score the cards set in a 52 bit mask
+    key = 0
+    cards = mask
+    while cards:
+        low = cards & -cards
+        key += _RANK_KEY[low.bit_length() - 1]
+        cards ^= low
+    return evaluate_key(key, mask)
+
+
+def evaluate_key(key, mask):
+    ## Score a hand from its summed rank key and 52 bit card mask
+    for shift in _SUIT_SHIFTS:
+        value = _FLUSH[(mask >> shift) & 0x1FFF]
+        if value:
+            return value
+    return _NOFLUSH.get(key)
+
+
+def _popcount(bits):
+    return bin(bits).count('1')
+
+
+_straight_draws = {}
+
+
+def _straight_draw_ranks(ranks):
+    ## Rank bits that would complete a straight for a 13 bit rank mask that
+    ## has none yet, memoized per mask
+    outs = _straight_draws.get(ranks)
+    if outs is None:
+        outs = 0
+        if not _straight_high(ranks):
+            for rank in range(13):
+                if not ranks >> rank & 1 and _straight_high(ranks | 1 << rank):
+                    outs |= 1 << rank
+        _straight_draws[ranks] = outs
+    return outs
+
+
+class HandTracker:
+    ## Running evaluation of one player's cards as the board comes out.
+    ## add() folds new cards into the rank key and mask, so each street costs
+    ## one table lookup however many times the result is read. Once a flop
+    ## is out and before the river, flush_outs and straight_outs are masks
+    ## of the unseen cards that would complete a flush or a straight the
+    ## hand does not already have; they are worked out on first read and
+    ## kept until the next street.
+    __slots__ = ('key', 'mask', 'count', 'value', '_draws')
+
+    def __init__(self, cards=()):
+        self.key = 0
+        self.mask = 0
+        self.count = 0
+        self.value = None
+        self.add(cards)
+
+    @classmethod
+    def from_mask(cls, mask):
+        ## Tracker over the cards set in a 52 bit mask
+        cards = []
+        while mask:
+            low = mask & -mask
+            cards.append(low.bit_length() - 1)
+            mask ^= low
+        return cls(cards)
+
+    def add(self, cards):
+        for card in cards:
+            self.key += _RANK_KEY[card]
+            self.mask |= 1 << card
+            self.count += 1
+        if self.count >= 5:
+            self.value = evaluate_key(self.key, self.mask)
+        self._draws = None
+
+    def _find_draws(self):
+        flush_outs = straight_outs = 0
+        if 5 <= self.count < 7:
+            made = self.value >> 20
+            ranks = 0
+            for shift in _SUIT_SHIFTS:
+                suited = (self.mask >> shift) & 0x1FFF
+                ranks |= suited
+                if made < FLUSH and _popcount(suited) == 4:
+                    flush_outs |= (~suited & 0x1FFF) << shift
+            if made < STRAIGHT:
+                draw = _straight_draw_ranks(ranks)
+                for shift in _SUIT_SHIFTS:
+                    straight_outs |= draw << shift
+        self._draws = (flush_outs, straight_outs)
+        return self._draws
+
+    @property
+    def category(self):
+        return None if self.value is None else self.value >> 20
+
+    @property
+    def flush_outs(self):
+        return (self._draws or self._find_draws())[0]
+
+    @property
+    def straight_outs(self):
+        return (self._draws or self._find_draws())[1]
+
+    @property
+    def outs(self):
+        ## Number of unseen cards completing a flush or straight draw
+        flush_outs, straight_outs = self._draws or self._find_draws()
+        return _popcount(flush_outs | straight_outs)
+
+
+_batch_tables = None
+
+
+def _numpy_tables():
+    ## numpy copies of the tables, built on first use. The non flush dict
+    ## becomes a sorted key array searched with np.searchsorted.
+    global _batch_tables
+    if _batch_tables is None:
+        if np is None:
+            raise ImportError("evaluate_many requires numpy")
+        keys = np.array(sorted(_NOFLUSH), dtype=np.int64)
+        values = np.array([_NOFLUSH[k] for k in keys.tolist()], dtype=np.int32)
+        _batch_tables = (np.array(_RANK_KEY, dtype=np.int64),
+                         np.array([1 << (c % 13) for c in range(52)], dtype=np.int64),
+                         np.array(_FLUSH, dtype=np.int32), keys, values)
+    return _batch_tables
+
+
+def evaluate_many(hole_cards, board, chunk_size=65536):
+    ## Vectorized evaluate() for N hands.
+    ## hole_cards: (N, 2) card ids. board: (N, k) card ids, or a single (k,)
+    ## board shared by every hand, with 3 <= k <= 5. Returns N int32
+    ## strengths equal to evaluate(). Work is done chunk_size rows at a time
+    ## so temporary arrays stay bounded however large N is. Like evaluate(),
+    ## raises ValueError if a row holds the same card twice.
+    rank_key, rank_bit, flush, keys, values = _numpy_tables()
+    hole_cards = np.asarray(hole_cards, dtype=np.int64)
+    board = np.asarray(board, dtype=np.int64)
+    if hole_cards.ndim != 2 or hole_cards.shape[1] != 2:
+        raise ValueError("hole_cards must have shape (N, 2)")
+    shared = board.ndim == 1
+    if board.shape[-1] not in (3, 4, 5) or (not shared and board.shape[0] != len(hole_cards)):
+        raise ValueError("board must have shape (N, 3-5) or (3-5,)")
+    if hole_cards.size and (hole_cards.min() < 0 or hole_cards.max() > 51) or \
+            board.size and (board.min() < 0 or board.max() > 51):
+        raise ValueError("card ids must be in 0-51")
+
+    if shared:
+        if len(np.unique(board)) != len(board):
+            raise ValueError("Duplicate cards")
+        # A shared board is folded into constants once instead of per row
+        board_key = int(rank_key[board].sum())
+        board_bits = [int(rank_bit[board[board // 13 == suit]].sum()) for suit in range(4)]
+
+    result = np.empty(len(hole_cards), dtype=np.int32)
+    for start in range(0, len(hole_cards), chunk_size):
+        hole = hole_cards[start:start + chunk_size]
+        if shared:
+            cards = hole
+            duplicate = (hole[:, 0] == hole[:, 1]).any() or np.isin(hole, board).any()
+            key = board_key + rank_key[hole].sum(axis=1)
+        else:
+            cards = np.concatenate((hole, board[start:start + chunk_size]), axis=1)
+            ordered = np.sort(cards, axis=1)
+            duplicate = (ordered[:, 1:] == ordered[:, :-1]).any()
+            key = rank_key[cards].sum(axis=1)
+        if duplicate:
+            raise ValueError("Duplicate cards")
+
+        suits = cards // 13
+        bits = rank_bit[cards]
+        best_flush = np.zeros(len(cards), dtype=np.int32)
+        for suit in range(4):
+            suit_bits = np.where(suits == suit, bits, 0).sum(axis=1)
+            if shared:
+                suit_bits += board_bits[suit]
+            np.maximum(best_flush, flush[suit_bits], out=best_flush)
+
+        no_flush = values[np.searchsorted(keys, key)]
+        result[start:start + len(cards)] = np.where(best_flush > 0, best_flush, no_flush)
+    return result
+
+
+def cross_check_many(samples=100000, seed=0):
+    ## evaluate_many against evaluate() on random hands, per row and shared board
+    rng = np.random.default_rng(seed)
+    cards = np.argsort(rng.random((samples, 52)), axis=1)[:, :7]
+    expected = [evaluate(row) for row in cards.tolist()]
+    if evaluate_many(cards[:, :2], cards[:, 2:], chunk_size=4096).tolist() != expected:
+        raise AssertionError("evaluate_many differs from evaluate")
+
+    board = [0, 14, 28, 42, 51]
+    holes = [c for c in itertools.combinations(range(52), 2) if not set(c) & set(board)]
+    expected = [evaluate(list(h) + board) for h in holes]
+    if evaluate_many(holes, board).tolist() != expected:
+        raise AssertionError("evaluate_many differs from evaluate on a shared board")
+    return samples + len(holes)
+
+
+def cross_check(samples=200000, seed=0):
+    ## Compare against the brute force evaluator in poker_logic.
+    ## Every 5 card hand is checked exhaustively: equal legacy tuples must map
+    ## to equal ints and the order of the distinct ints must match the order
+    ## of the tuples. 6 and 7 card hands are then checked on random samples.
+    from poker_logic import CARDS as deck, HandEvaluator
+
+    def legacy_key(result):
+        return tuple(tuple(part) if isinstance(part, list) else part
+                     for part in result)
+
+    by_value = {}
+    for combo in itertools.combinations(range(52), 5):
+        legacy = legacy_key(HandEvaluator._evaluate_combo([deck[c] for c in combo]))
+        value = evaluate(combo)
+        seen = by_value.setdefault(value, legacy)
+        if seen != legacy:
+            raise AssertionError(f"{combo}: {value} maps to {seen} and {legacy}")
+
+    ordered = sorted(by_value)
+    for lower, higher in zip(ordered, ordered[1:]):
+        if not by_value[lower] < by_value[higher]:
+            raise AssertionError(f"order differs: {by_value[lower]} vs {by_value[higher]}")
+
+    by_legacy = {legacy: value for value, legacy in by_value.items()}
+    rng = random.Random(seed)
+    for i in range(samples):
+        combo = rng.sample(range(52), 6 + i % 2)
+        legacy = HandEvaluator._evaluate_brute_force([deck[c] for c in combo])
+        if by_legacy[legacy_key(legacy)] != evaluate(combo):
+            raise AssertionError(f"{combo}: mismatch with brute force")
+    return len(by_value)
+
+
+if __name__ == "__main__":
+    print(f"{cross_check()} distinct 5 card strengths match the brute force evaluator")
+    if np is not None:
+        print(f"{cross_check_many()} hands match between evaluate_many and evaluate")
@@ -0,0 +1,201 @@
+# hand_history.py
+# Append-only hand histories.
+#
+# PokerGame.recorder is fed one event per step of a hand:
+#     start     export_state() right after blinds and dealing (deck included)
+#     action    seat, action as sent, chips put in
+#     board     phase and the whole board after each street is dealt
+#     showdown  pot, winning seats, [amount, winning seats] per side pot
+#               and the hands that were shown
+# HandHistoryWriter queues them and a background thread appends them as
+# JSON lines in batches, so socket handlers never wait on disk. Files are
+# fsync'd every fsync_interval seconds and rotated past max_bytes.
+#
+# read_records() streams any number of rotated files in constant memory,
+# iter_hands() regroups interleaved tables into hands and replay() rebuilds
+# the PokerGame of a hand after any number of its actions.
+#
+#     python hand_history.py stats hand_history/
+#     python hand_history.py replay hand_history/ --table <game_id> --hand 3 --actions 5
+
+import argparse
+import glob
+import json
+import os
+import queue
+import threading
+import time
+
+from poker_logic import GamePhase, Player, PokerGame
+
+_STOP = object()
+
+
+class HandHistoryWriter:
+    def __init__(self, directory, max_bytes=64 * 1024 * 1024, fsync_interval=1.0,
+                 batch_size=1024, queue_size=100000):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.fsync_interval = fsync_interval
+        self.batch_size = batch_size
+        self.written = 0
+        self.dropped = 0  # records lost because the queue was full
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._file = None
+        self._sequence = 0
+        os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name='hand-history', daemon=True)
+        self._thread.start()
+
+    def write(self, record):
+        ## Never blocks the caller; a full queue drops the record
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def recorder(self, table_id):
+        ## Callable for PokerGame.recorder that tags records with the table
+        def record(kind, fields):
+            fields['t'] = kind
+            fields['table'] = table_id
+            fields['ts'] = time.time()
+            self.write(fields)
+        return record
+
+    def close(self):
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _open_next(self):
+        if self._file:
+            self._sync()
+            self._file.close()
+        self._sequence += 1
+        name = f"hands-{time.strftime('%Y%m%d-%H%M%S')}-{self._sequence:04d}.jsonl"
+        self._file = open(os.path.join(self.directory, name), 'a', encoding='utf-8')
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._last_sync = time.monotonic()
+
+    def _run(self):
+        self._open_next()
+        self._last_sync = time.monotonic()
+        stopping = False
+        while not stopping:
+            try:
+                batch = [self._queue.get(timeout=self.fsync_interval)]
+            except queue.Empty:
+                batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if _STOP in batch:
+                stopping = True
+                batch = [record for record in batch if record is not _STOP]
+
+            if batch:
+                self._file.write(''.join(json.dumps(record, separators=(',', ':')) + '\n'
+                                         for record in batch))
+                self._file.flush()
+                self.written += len(batch)
+            if stopping or time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync()
+            if self._file.tell() >= self.max_bytes:
+                self._open_next()
+        self._file.close()
+
+
+def history_files(path):
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, 'hands-*.jsonl')))
+    return [path]
+
+
+def read_records(path):
+    ## Stream records from a file or a directory of rotated files. A torn
+    ## last line (crash mid-write) ends that file instead of failing.
+    for filename in history_files(path):
+        with open(filename, encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    break
+
+
+def iter_hands(records):
+    ## Group a record stream into complete hands: lists starting with the
+    ## 'start' record and ending with 'showdown'. Only hands in progress are
+    ## held in memory.
+    open_hands = {}
+    for record in records:
+        key = (record['table'], record['hand'])
+        if record['t'] == 'start':
+            open_hands[key] = [record]
+        elif key in open_hands:
+            open_hands[key].append(record)
+            if record['t'] == 'showdown':
+                yield open_hands.pop(key)
+
+
+def replay(hand, actions=None):
+    ## PokerGame as it was after the first `actions` actions of a hand
+    ## (all of them by default), streets dealt in between as in play
+    state = hand[0]['state']
+    players = [Player(name, chips, ai_level) for name, chips, ai_level, *_ in state['players']]
+    game = PokerGame(players, headless=True)
+    game.load_state(state)
+    done = 0
+    for record in hand[1:]:
+        if record['t'] != 'action':
+            continue
+        if actions is not None and done >= actions:
+            break
+        while game.street_complete and game.current_phase != GamePhase.SHOWDOWN:
+            game.next_street()
+        game.apply_action(game.players[record['seat']], record['action'], record['amount'])
+        done += 1
+    return game
+
+
+def _find_hand(path, table, number):
+    for hand in iter_hands(read_records(path)):
+        if hand[0]['table'] == table and hand[0]['hand'] == number:
+            return hand
+    return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Read and replay hand histories')
+    sub = parser.add_subparsers(dest='command', required=True)
+    stats = sub.add_parser('stats')
+    stats.add_argument('path')
+    play = sub.add_parser('replay')
+    play.add_argument('path')
+    play.add_argument('--table', required=True)
+    play.add_argument('--hand', type=int, required=True)
+    play.add_argument('--actions', type=int)
+    args = parser.parse_args()
+
+    if args.command == 'stats':
+        hands = records = 0
+        for hand in iter_hands(read_records(args.path)):
+            hands += 1
+            records += len(hand)
+        print(f"{hands} hands, {records} records")
+    else:
+        hand = _find_hand(args.path, args.table, args.hand)
+        if hand is None:
+            raise SystemExit('hand not found')
+        game = replay(hand, args.actions)
+        print(f"{game.current_phase.value}: board {game.community_cards}, pot {game.pot}")
+        for player in game.players:
+            print(f"  {player.name}: {player.hand} chips {player.chips} bet {player.current_bet}"
+                  f"{' folded' if player.folded else ''}")
@@ -0,0 +1,371 @@
+# loadtest.py
+# Load generator for app.py: many simulated browsers against a locally
+# started server, with no external services.
+#
+# Every virtual client opens its own Socket.IO connection (WebSocket
+# transport, spoken directly over asyncio streams with wsproto, which
+# simple-websocket already brings in), then plays like the browser does:
+# create_game with num_ai, join_game, and player_action whenever it is its
+# turn, acking every game_update and resyncing when a delta does not apply.
+# When its table stops (the human is broke or alone) it opens another one.
+#
+# Latency is measured from sending an event to the reply it waits for:
+# game_created for create_game, game_update for join_game and
+# player_action. The server's RSS is sampled from /proc while the test runs.
+#
+#     python loadtest.py --clients 2000 --ramp 200 --duration 60 --num-ai 5
+#     python loadtest.py --clients 500 --policy fold:1,call:6,raise:3 -o load.json
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import time
+
+from wsproto import ConnectionType, WSConnection
+from wsproto.events import CloseConnection, Ping, RejectConnection, Request, TextMessage
+
+from cluster import worker_env
+
+EVENTS = ('create_game', 'join_game', 'player_action')
+
+
+class LoadStats:
+    def __init__(self):
+        self.latencies = {event: [] for event in EVENTS}
+        self.sent = {event: 0 for event in EVENTS}
+        self.errors = {}  # kind -> count
+        self.connected = 0
+        self.tables = 0
+        self.samples = []  # one dict per RSS sample
+
+    def error(self, kind):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def report(self, elapsed):
+        events = {}
+        for event in EVENTS:
+            latencies = sorted(self.latencies[event])
+            stats = {'sent': self.sent[event], 'completed': len(latencies),
+                     'per_sec': len(latencies) / elapsed if elapsed else 0.0}
+            for name, q in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99)):
+                stats[f'{name}_ms'] = \
+                    latencies[min(int(q * len(latencies)), len(latencies) - 1)] * 1000 if latencies else None
+            events[event] = stats
+        sent = sum(self.sent.values())
+        errors = sum(self.errors.values())
+        return {
+            'elapsed': elapsed,
+            'events': events,
+            'errors': dict(self.errors),
+            'error_rate': errors / sent if sent else 0.0,
+            'tables': self.tables,
+            'rss': self.samples,
+        }
+
+
+class SocketIOClient:
+    ## Just enough of Engine.IO 4 / Socket.IO 5 over a WebSocket for the
+    ## events app.py uses: text packets, no acks, no binary
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.inbox = asyncio.Queue()
+        self._ws = WSConnection(ConnectionType.CLIENT)
+        self._reader = self._writer = None
+        self._connected = asyncio.Event()
+        self._task = None
+
+    async def connect(self, timeout=10.0):
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), timeout)
+        self._writer.write(self._ws.send(Request(
+            host=f"{self.host}:{self.port}", target='/socket.io/?EIO=4&transport=websocket')))
+        self._task = asyncio.ensure_future(self._read())
+        await asyncio.wait_for(self._connected.wait(), timeout)
+
+    def _send_text(self, text):
+        self._writer.write(self._ws.send(TextMessage(data=text)))
+
+    def emit(self, event, data):
+        self._send_text('42' + json.dumps([event, data], separators=(',', ':')))
+
+    async def receive(self, names, timeout):
+        ## Next event named in `names`, as (name, data); others are dropped
+        while True:
+            name, data = await asyncio.wait_for(self.inbox.get(), timeout)
+            if name in names:
+                return name, data
+
+    async def _read(self):
+        text = []
+        try:
+            while True:
+                data = await self._reader.read(65536)
+                if not data:
+                    break
+                self._ws.receive_data(data)
+                for event in self._ws.events():
+                    if isinstance(event, TextMessage):
+                        text.append(event.data)
+                        if event.message_finished:
+                            self._packet(''.join(text))
+                            text = []
+                    elif isinstance(event, Ping):
+                        self._writer.write(self._ws.send(event.response()))
+                    elif isinstance(event, CloseConnection):
+                        self._writer.write(self._ws.send(event.response()))
+                        return
+                    elif isinstance(event, RejectConnection):
+                        return
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.inbox.put_nowait(('disconnect', None))
+
+    def _packet(self, packet):
+        kind = packet[:1]
+        if kind == '0':  # Engine.IO open: join the default namespace
+            self._send_text('40')
+        elif kind == '2':  # Engine.IO ping
+            self._send_text('3')
+        elif packet.startswith('40'):
+            self._connected.set()
+        elif packet.startswith('42'):
+            name, *args = json.loads(packet[2:])
+            self.inbox.put_nowait((name, args[0] if args else None))
+        elif packet.startswith('41') or kind == '1':
+            self.inbox.put_nowait(('disconnect', None))
+
+    async def close(self):
+        if self._writer is not None:
+            try:
+                self._send_text('41')
+                self._writer.close()
+            except (ConnectionError, OSError):
+                pass
+        if self._task is not None:
+            self._task.cancel()
+
+
+def parse_policy(text):
+    ## "call" or weighted actions such as "fold:1,call:6,raise:3"
+    weights = {}
+    for part in text.split(','):
+        action, _, weight = part.partition(':')
+        if action not in ('fold', 'call', 'raise'):
+            raise ValueError(f"Unknown action in policy: {action}")
+        weights[action] = float(weight) if weight else 1.0
+    return list(weights), list(weights.values())
+
+
+def apply_update(state, version, update):
+    ## The browser's applyUpdate: returns (state, version), or None when
+    ## the delta does not apply and a resync is needed
+    if update.get('full'):
+        return update['state'], update['version']
+    if state is None or update.get('base') != version:
+        return None
+    if 'events' in update:
+        deltas = [event['delta'] for event in update['events']] + [update['private']]
+    else:
+        deltas = [update['delta']]
+    for delta in deltas:
+        for key, value in delta.items():
+            if key == 'players':
+                for index, fields in value.items():
+                    state['players'][int(index)].update(fields)
+            else:
+                state[key] = value
+    return state, update['version']
+
+
+async def run_client(index, args, stats, stop_at, rng):
+    client = SocketIOClient(args.host, args.port)
+    try:
+        await client.connect(args.timeout)
+    except (OSError, asyncio.TimeoutError):
+        stats.error('connect')
+        return
+    stats.connected += 1
+    actions, weights = args.policy
+
+    async def request(event, data, replies):
+        ## Send one event and time it to the first of `replies`
+        stats.sent[event] += 1
+        start = time.perf_counter()
+        client.emit(event, data)
+        try:
+            name, reply = await client.receive(replies + ('error', 'action_result', 'disconnect'),
+                                               args.timeout)
+        except asyncio.TimeoutError:
+            stats.error(f'{event}_timeout')
+            return None
+        if name not in replies:
+            stats.error(f'{event}_{name}')
+            return None
+        stats.latencies[event].append(time.perf_counter() - start)
+        return reply
+
+    try:
+        while time.monotonic() < stop_at:
+            created = await request('create_game', {'num_ai': args.num_ai}, ('game_created',))
+            if created is None:
+                break
+            game_id = created['game_id']
+            update = await request('join_game', {'game_id': game_id, 'name': f"Load {index}"},
+                                   ('game_update',))
+            stats.tables += 1
+            state = version = None
+            while update is not None:
+                applied = apply_update(state, version, update)
+                if applied is None:
+                    stats.error('resync')
+                    client.emit('resync', {'game_id': game_id})
+                    try:
+                        _, update = await client.receive(('game_update',), args.timeout)
+                    except asyncio.TimeoutError:
+                        stats.error('resync_timeout')
+                        break
+                    continue
+                state, version = applied
+                client.emit('ack_state', {'game_id': game_id, 'version': version})
+                if not state.get('is_player_turn') or time.monotonic() >= stop_at:
+                    break  # table stopped: start another one
+                if args.think:
+                    await asyncio.sleep(rng.uniform(0, 2 * args.think))
+                action = rng.choices(actions, weights)[0]
+                data = {'game_id': game_id, 'action': action}
+                if action == 'raise':
+                    data['amount'] = 2 * state.get('current_bet', 0)
+                update = await request('player_action', data, ('game_update',))
+    except (ConnectionError, OSError):
+        stats.error('connection')
+    finally:
+        stats.connected -= 1
+        await client.close()
+
+
+def server_rss(pid):
+    ## Resident set size of a process in bytes, None off Linux
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+async def sample_rss(pid, stats, interval, began):
+    while True:
+        done = sum(len(latencies) for latencies in stats.latencies.values())
+        stats.samples.append({'t': round(time.monotonic() - began, 2), 'rss': server_rss(pid),
+                              'clients': stats.connected, 'events': done})
+        await asyncio.sleep(interval)
+
+
+async def run_load(args, pid):
+    stats = LoadStats()
+    began = time.monotonic()
+    stop_at = began + args.duration
+    sampler = asyncio.ensure_future(sample_rss(pid, stats, args.interval, began))
+    tasks = []
+    for index in range(args.clients):
+        tasks.append(asyncio.ensure_future(
+            run_client(index, args, stats, stop_at, random.Random(args.seed * 1000003 + index))))
+        if args.ramp:
+            await asyncio.sleep(1.0 / args.ramp)
+    await asyncio.gather(*tasks)
+    sampler.cancel()
+    return stats.report(time.monotonic() - began)
+
+
+def start_server(host, port, ai_workers=None, timeout=30.0):
+    ## Run app.py as the only worker on host:port and wait until it listens
+    env = worker_env(0, [f"http://{host}:{port}"])
+    env['POKER_HOST'] = host
+    env['POKER_PORT'] = str(port)
+    if ai_workers is not None:
+        env['POKER_AI_WORKERS'] = str(ai_workers)
+    app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+    process = subprocess.Popen([sys.executable, app_path], env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            socket.create_connection((host, port), timeout=1.0).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f"Server did not start listening on {host}:{port}")
+
+
+def raise_file_limit():
+    ## Every client and its server side socket needs a descriptor
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+
+def print_report(report):
+    print(f"{report['elapsed']:.1f}s, {report['tables']} tables, "
+          f"error rate {report['error_rate']:.2%} {report['errors'] or ''}")
+    for event, stats in report['events'].items():
+        if not stats['sent']:
+            continue
+        print(f"{event:<14} {stats['completed']:>8} ok {stats['per_sec']:>9,.1f}/s  "
+              f"p50 {stats['p50_ms'] or 0:>8.1f}ms  p95 {stats['p95_ms'] or 0:>8.1f}ms  "
+              f"p99 {stats['p99_ms'] or 0:>8.1f}ms")
+    for sample in report['rss']:
+        rss = f"{sample['rss'] / 2 ** 20:,.1f} MB" if sample['rss'] else 'n/a'
+        print(f"  t={sample['t']:>7.1f}s  rss {rss:>10}  clients {sample['clients']:>6}  "
+              f"events {sample['events']:>8}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test app.py with simulated clients')
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--ramp', type=float, default=100, help='clients started per second, 0 for all at once')
+    parser.add_argument('--duration', type=float, default=30, help='seconds before clients stop')
+    parser.add_argument('--num-ai', type=int, default=5)
+    parser.add_argument('--policy', type=parse_policy, default=parse_policy('call'),
+                        help='action weights, e.g. fold:1,call:6,raise:3')
+    parser.add_argument('--think', type=float, default=0.5, help='mean seconds before acting')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds between RSS samples')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5050)
+    parser.add_argument('--ai-workers', type=int, help='POKER_AI_WORKERS for the server')
+    parser.add_argument('--no-server', action='store_true', help='use a server already running')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', help='write the JSON report here')
+    args = parser.parse_args(argv)
+
+    raise_file_limit()
+    server = None if args.no_server else start_server(args.host, args.port, args.ai_workers)
+    try:
+        report = asyncio.run(run_load(args, server.pid if server else None))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,330 @@
+# metrics.py
+# In-process metrics rendered in the Prometheus text format, and a sampling
+# profiler that can be switched on for single tables.
+#
+# Modules declare their metrics once at import:
+#
+#     events = metrics.histogram('poker_event_seconds', 'Handler latency', ['event'])
+#     events.labels('join_game').observe(0.0012)
+#
+# and app.py serves render() on /metrics. Updates are a lock and an add,
+# cheap enough to stay on. For counters bumped on every hand evaluation
+# even that shows, so tally() gives counters that each thread adds to
+# without a lock and that are summed at scrape time. Gauges are read from a
+# callback at scrape time.
+#
+# The profiler samples, every `interval` seconds, the stacks of threads
+# that are working on a profiled table (see profiler.table()), and keeps
+# them as collapsed stacks ("frame;frame;frame count") for flame graphs.
+
+import bisect
+import sys
+import threading
+import time
+from collections import Counter as _Tally
+from contextlib import contextmanager
+
+# Latency buckets in seconds, payload buckets in bytes
+TIME_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                0.25, 0.5, 1.0, 2.5)
+SIZE_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 65536)
+
+_metrics = []
+
+
+def _label_text(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{value}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._child())
+        return child
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(child.render(self.name, _label_text(self.labelnames, values)))
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def render(self, name, labels):
+        return [f"{name}{labels} {self.value}"]
+
+
+class _TallyChild:
+    ## Counter child with one slot per thread, so inc() takes no lock.
+    ## Slots outlive their threads to keep the total monotonic.
+    __slots__ = ('_local', '_slots', '_lock')
+
+    def __init__(self):
+        self._local = threading.local()
+        self._slots = []
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        try:
+            self._local.slot[0] += amount
+        except AttributeError:
+            slot = self._local.slot = [amount]
+            with self._lock:
+                self._slots.append(slot)
+
+    @property
+    def value(self):
+        with self._lock:
+            return sum(slot[0] for slot in self._slots)
+
+    def render(self, name, labels):
+        return [f"{name}{labels} {self.value}"]
+
+
+class _HistogramChild:
+    __slots__ = ('buckets', 'counts', 'sum', 'count', '_lock')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            if index < len(self.counts):
+                self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def render(self, name, labels):
+        prefix = labels[:-1] + ',' if labels else '{'
+        lines = []
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            lines.append(f'{name}_bucket{prefix}le="{bound}"}} {total}')
+        lines.append(f'{name}_bucket{prefix}le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum{labels} {self.sum}")
+        lines.append(f"{name}_count{labels} {self.count}")
+        return lines
+
+
+class _SummaryChild:
+    __slots__ = ('sum', 'count', '_lock')
+
+    def __init__(self):
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value, count=1):
+        with self._lock:
+            self.sum += value
+            self.count += count
+
+    def render(self, name, labels):
+        return [f"{name}_sum{labels} {self.sum}", f"{name}_count{labels} {self.count}"]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Tally(Counter):
+    def _child(self):
+        return _TallyChild()
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=TIME_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+
+class Summary(_Metric):
+    ## Count and total only, for hot paths where bucketing costs too much.
+    ## observe(value, count) records `count` events taking `value` in all.
+    kind = 'summary'
+
+    def _child(self):
+        return _SummaryChild()
+
+    def observe(self, value, count=1):
+        self.labels().observe(value, count)
+
+
+class Gauge(_Metric):
+    ## Value(s) read at scrape time. fn returns a number, or with labelnames
+    ## a dict of label value tuples to numbers.
+    kind = 'gauge'
+
+    def __init__(self, name, help, fn, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self.fn = fn
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        value = self.fn()
+        if self.labelnames:
+            for values, number in sorted(value.items()):
+                lines.append(f"{self.name}{_label_text(self.labelnames, values)} {number}")
+        elif value is not None:
+            lines.append(f"{self.name} {value}")
+        return lines
+
+
+def counter(name, help, labelnames=()):
+    return Counter(name, help, labelnames)
+
+
+def tally(name, help, labelnames=()):
+    return Tally(name, help, labelnames)
+
+
+def histogram(name, help, labelnames=(), buckets=TIME_BUCKETS):
+    return Histogram(name, help, labelnames, buckets)
+
+
+def summary(name, help, labelnames=()):
+    return Summary(name, help, labelnames)
+
+
+def gauge(name, help, fn, labelnames=()):
+    return Gauge(name, help, fn, labelnames)
+
+
+def render():
+    ## Every metric declared so far, in the Prometheus text format
+    lines = []
+    for metric in _metrics:
+        try:
+            lines.extend(metric.render())
+        except Exception as e:  # a broken gauge must not take /metrics down
+            lines.append(f"# {metric.name} unavailable: {e}")
+    return '\n'.join(lines) + '\n'
+
+
+class SamplingProfiler:
+    def __init__(self, interval=0.005, max_stacks=5000):
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.tables = {}  # game_id -> Counter of collapsed stacks
+        self._working = {}  # thread id -> game_id it is working on
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def enable(self, game_id):
+        with self._lock:
+            self.tables.setdefault(game_id, _Tally())
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample, name='profiler', daemon=True)
+                self._thread.start()
+
+    def disable(self, game_id):
+        ## Stop profiling game_id and return its collapsed stacks
+        with self._lock:
+            return self.tables.pop(game_id, None)
+
+    def stacks(self, game_id):
+        with self._lock:
+            tally = self.tables.get(game_id)
+            return None if tally is None else _Tally(tally)
+
+    @contextmanager
+    def table(self, game_id):
+        ## Mark the calling thread as working on game_id. Nearly free while
+        ## that table is not being profiled.
+        if game_id not in self.tables:
+            yield
+            return
+        thread_id = threading.get_ident()
+        self._working[thread_id] = game_id
+        try:
+            yield
+        finally:
+            self._working.pop(thread_id, None)
+
+    def _sample(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self.tables:
+                    self._thread = None
+                    return
+                if not self._working:
+                    continue
+                frames = sys._current_frames()
+                for thread_id, game_id in list(self._working.items()):
+                    tally = self.tables.get(game_id)
+                    frame = frames.get(thread_id)
+                    if tally is None or frame is None:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]})")
+                        frame = frame.f_back
+                    key = ';'.join(reversed(stack))
+                    if key in tally or len(tally) < self.max_stacks:
+                        tally[key] += 1
+
+
+def collapsed(tally):
+    ## Collapsed stack text, one "stack count" line per distinct stack
+    return ''.join(f"{stack} {count}\n" for stack, count in tally.most_common())
+
+
+profiler = SamplingProfiler()
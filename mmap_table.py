@@ -0,0 +1,52 @@
+# mmap_table.py
+# The file plumbing shared by the precomputed tables (preflop_table,
+# strategy_table): a struct header followed by the table body, written
+# atomically at build time and memory-mapped read-only at runtime.
+
+import mmap
+import os
+import threading
+
+
+def write(path, *parts):
+    ## Write the packed header and body parts to path atomically, so a
+    ## running server never maps a half written file
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        for part in parts:
+            f.write(part)
+    os.replace(tmp_path, path)
+
+
+def open_map(path, header, valid):
+    ## (map, header fields) for the file at path, or None if it is missing,
+    ## shorter than its header, or valid(fields, size) rejects it
+    try:
+        with open(path, 'rb') as f:
+            table = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (FileNotFoundError, ValueError):
+        return None
+    if len(table) < header.size:
+        table.close()
+        return None
+    fields = header.unpack_from(table)
+    if not valid(fields, len(table)):
+        table.close()
+        return None
+    return table, fields
+
+
+class Shared:
+    ## One instance of factory(), made on first use; threads racing for the
+    ## first one wait on a lock instead of opening the file twice
+    def __init__(self, factory):
+        self.factory = factory
+        self._instance = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self._instance = self.factory()
+        return self._instance
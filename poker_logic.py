@@ -1,6 +1,24 @@
 import random
 import itertools
+import time
 from enum import Enum
+import hand_evaluator
+import equity_cache
+import metrics
+import pots
+import preflop_table
+import strategy_table
+
+# Hands evaluated and time taken, by path. Timing is per batch, never per
+# hand: one observation per evaluate_many call, per street of tracker updates
+# and per showdown. Direct evaluate_hand calls are too cheap to time and are
+# only counted.
+_evaluations = metrics.summary('poker_evaluator_seconds', 'Hand evaluator time and calls', ['path'])
+_EVALUATE_MANY = _evaluations.labels('evaluate_many')
+_TRACKER = _evaluations.labels('tracker')
+_SHOWDOWN = _evaluations.labels('showdown')
+_EVALUATE_HAND_CALLS = metrics.tally('poker_evaluator_calls_total',
+                                     'Direct HandEvaluator.evaluate_hand calls').labels()
 
 class Suit(Enum):
     HEARTS = "♥"
@@ -38,15 +56,60 @@ class GamePhase(Enum):
     def __lt__(self, other):
         return self.value[0] < other.value[0]
 
+_SUIT_INDEX = {suit: i for i, suit in enumerate(Suit)}
+_INTERNED_CARDS = {}
+
 class Card:
-    def __init__(self, rank, suit):
-        self.rank = rank
-        self.suit = suit
+    ## Cards are interned: Card(rank, suit) always returns the same object,
+    ## carrying its int id (see hand_evaluator), rank/suit bits and the one
+    ## bit mask used for 64-bit hand and board masks.
+    __slots__ = ('rank', 'suit', 'id', 'rank_bits', 'suit_bits', 'mask', '_label')
+
+    def __new__(cls, rank, suit):
+        card = _INTERNED_CARDS.get((rank, suit))
+        if card is None:
+            card = super().__new__(cls)
+            rank_index = rank.value[0] - 2
+            suit_index = _SUIT_INDEX[suit]
+            card.rank = rank
+            card.suit = suit
+            card.id = hand_evaluator.card_id(rank_index, suit_index)
+            card.rank_bits = 1 << rank_index
+            card.suit_bits = 1 << suit_index
+            card.mask = 1 << card.id
+            card._label = f"{rank.value[1]}{suit.value}"
+            _INTERNED_CARDS[rank, suit] = card
+        return card
+
+    def __reduce__(self):
+        return (Card, (self.rank, self.suit))
 
     def __repr__(self):
-        return f"{self.rank.value[1]}{self.suit.value}"
+        return self._label
+
+# Every card indexed by its id
+CARDS = tuple(Card(rank, suit) for suit in Suit for rank in Rank)
+
+ACTIONS = ('fold', 'call', 'raise', 'all_in')
+
+def cards_mask(cards):
+    mask = 0
+    for card in cards:
+        mask |= card.mask
+    return mask
+
+def mask_cards(mask):
+    ## Cards of a mask in id order
+    cards = []
+    while mask:
+        low = mask & -mask
+        cards.append(CARDS[low.bit_length() - 1])
+        mask ^= low
+    return cards
 
 class HandStrength:
+    __slots__ = ('strength', 'ranks', 'kickers')
+
     def __init__(self, strength, ranks, kickers=[]):
         self.strength = strength
         self.ranks = ranks
@@ -64,6 +127,12 @@ class HandStrength:
                 self.ranks == other.ranks and 
                 self.kickers == other.kickers)
 
+    @classmethod
+    def from_value(cls, value):
+        ## Build from an integer strength returned by HandEvaluator
+        strength, ranks, kickers = hand_evaluator.decode(value)
+        return cls(strength, ranks, kickers)
+
 class Player:
     def __init__(self, name, chips=1000, ai_level=1):
         self.name = name
@@ -71,14 +140,44 @@ class Player:
         self.hand = []
         self.ai_level = ai_level
         self.current_bet = 0
+        self.total_bet = 0  # chips put in over the whole hand, for side pots
+        self.tracker = None  # HandTracker over hand + board, kept by PokerGame
 
     def __repr__(self):
         return f"{self.name} ({self.chips} chips)"
 
+    @property
+    def hand_mask(self):
+        return cards_mask(self.hand)
+
 class HandEvaluator:
     @staticmethod
     def evaluate_hand(hole_cards, community_cards):
-        all_cards = hole_cards + community_cards
+        ## Returns an int strength, higher is better, or None with fewer
+        ## than 5 cards. 5-7 cards are a single table lookup. Takes lists of
+        ## cards or two card masks.
+        _EVALUATE_HAND_CALLS.inc()
+        if isinstance(hole_cards, int):
+            value = hand_evaluator.evaluate_mask(hole_cards | community_cards)
+        else:
+            ids = [c.id for c in hole_cards + community_cards]
+            if len(ids) <= 7:
+                value = hand_evaluator.evaluate(ids)
+            else:
+                value = max(hand_evaluator.evaluate(combo) for combo in itertools.combinations(ids, 5))
+        return value
+
+    @staticmethod
+    def evaluate_many(hole_cards, board, chunk_size=65536):
+        ## Batch evaluate_hand over card id arrays (Card.id), needs numpy.
+        ## hole_cards is (N, 2); board is (N, 5) or one board shared by all.
+        start = time.perf_counter()
+        values = hand_evaluator.evaluate_many(hole_cards, board, chunk_size)
+        _EVALUATE_MANY.observe(time.perf_counter() - start, len(values))
+        return values
+
+    @staticmethod
+    def _evaluate_brute_force(all_cards):
         all_combinations = itertools.combinations(all_cards, 5)
         
         best_hand = None
@@ -96,13 +195,14 @@ class HandEvaluator:
         # Count occurrences
         rank_counts = {rank: ranks.count(rank) for rank in set(ranks)}
         flush = len(set(suits)) == 1
-        straight = (max(ranks) - min(ranks) == 4 and len(set(ranks)) == 5) or \
-                   (ranks == [14, 5, 4, 3, 2])
+        wheel = ranks == [14, 5, 4, 3, 2]
+        straight = (max(ranks) - min(ranks) == 4 and len(set(ranks)) == 5) or wheel
+        high = 5 if wheel else max(ranks)  # A-2-3-4-5 is a five high straight
         
         # Determine hand strength
         if straight and flush:
-            if max(ranks) == 14: return (9, ranks)  # Royal flush
-            return (8, [max(ranks)])  # Straight flush
+            if high == 14: return (9, ranks)  # Royal flush
+            return (8, [high])  # Straight flush
         if 4 in rank_counts.values():
             quad_rank = [k for k,v in rank_counts.items() if v==4][0]
             return (7, [quad_rank], [k for k in ranks if k != quad_rank])
@@ -113,7 +213,7 @@ class HandEvaluator:
         if flush:
             return (5, ranks)
         if straight:
-            return (4, [max(ranks)])
+            return (4, [high])
         if 3 in rank_counts.values():
             trip_rank = [k for k,v in rank_counts.items() if v==3][0]
             return (3, [trip_rank], ranks)
@@ -127,11 +227,25 @@ class HandEvaluator:
 
 
 class PokerGame:
-    def __init__(self, players):
+    def __init__(self, players, rng=None, headless=False, seed=None):
+        # rng: anything with shuffle/choice/random, defaults to a
+        # random.Random(seed) of this table's own so tables never share RNG
+        # state. headless: never print, for simulations.
+        self.rng = rng if rng is not None else random.Random(seed)
+        self._pack = list(CARDS)  # reshuffled in place, never rebuilt
+        self.headless = headless
+
          # Add these initializations
         self.current_player = None
         self.current_player_index = 0
         self.active_players = []
+        self.needs_action = []
+        self.action_index = 0
+        self.raises = 0
+        self.max_raises = 4
+        self.last_pots = []
+        self.hand_number = 0
+        self.recorder = None  # callable(kind, fields) fed hand events, see hand_history
         
         # Existing initialization code
         self.current_phase = GamePhase.PREFLOP
@@ -208,7 +322,7 @@ class PokerGame:
         self.community_cards = []
         self.pot = 0
         self.current_bet = 0
-        self.deck = self.new_deck()
+        self.new_deck()
         self.deal_hole_cards()
         self.current_phase = GamePhase.PREFLOP
 
@@ -228,48 +342,6 @@ class PokerGame:
 
         self.current_player_index = (self.dealer_position + 3) % len(self.active_players)
 
-    def betting_round(self):
-        if not self.active_players:
-            return
-
-        # Start with first active player after big blind
-        self.current_player_index = 0
-        last_raise_index = -1
-        players_acted = 0
-        needs_to_act = len([p for p in self.active_players if not p.folded])
-
-        while True:
-            if not self.active_players:
-                break
-
-            # Rotate through active players
-            current_player = self.active_players[self.current_player_index % len(self.active_players)]
-            
-            if current_player.folded:
-                self.current_player_index += 1
-                continue
-
-            # Get player action (AI or human)
-            action = self.get_player_action(current_player)
-            
-            if action == 'raise':
-                last_raise_index = self.current_player_index
-                players_acted = 0
-            elif action == 'fold':
-                current_player.folded = True
-                needs_to_act -= 1
-
-            players_acted += 1
-            self.current_player_index += 1
-
-            # End betting when all players have acted and no raises remain
-            if players_acted >= needs_to_act and self.current_player_index > last_raise_index:
-                break
-
-            # Check if only one player remains
-            if len([p for p in self.active_players if not p.folded]) <= 1:
-                break
-
     def advance_phase(self):
         phases = list(GamePhase)
         current_index = phases.index(self.current_phase)
@@ -281,49 +353,111 @@ class PokerGame:
             elif self.current_phase in [GamePhase.TURN, GamePhase.RIVER]:
                 self.deal_community_cards(1)
 
-    def new_deck(self):
-        ##  Create and shuffle a new deck
-        self.deck = [Card(rank, suit) for suit in Suit for rank in Rank]
-        random.shuffle(self.deck)
+    def new_deck(self, cards=52):
+        ## Shuffle the next `cards` cards to deal into self.deck with a
+        ## partial Fisher-Yates over the table's pack: one swap per card
+        ## dealt. Reshuffling the last permutation is as random as shuffling
+        ## a fresh deck, so the pack is never rebuilt.
+        pack = self._pack
+        draw = self.rng.random
+        last = len(pack) - 1
+        for i in range(last, last - cards, -1):
+            j = int(draw() * (i + 1))
+            pack[i], pack[j] = pack[j], pack[i]
+        self.deck = pack[len(pack) - cards:]
         self.community_cards = []
 
     def deal_hole_cards(self):
         ## Deal 2 private cards to each player
-        print(f"Dealing cards from deck size: {len(self.deck)}")
+        if not self.headless:
+            print(f"Dealing cards from deck size: {len(self.deck)}")
         for _ in range(2):  # Deal two cards
             for player in self.active_players:
                 if len(self.deck) < 1:
                     raise ValueError("Not enough cards in deck")
                 player.hand.append(self.deck.pop())
+        for player in self.active_players:
+            player.tracker = hand_evaluator.HandTracker([c.id for c in player.hand])
+
+    @property
+    def board_mask(self):
+        return cards_mask(self.community_cards)
 
     def deal_community_cards(self, num=1):
         if not self.active_players:
             return
         
-        for _ in range(num):
-            self.community_cards.append(self.deck.pop())
+        dealt = [self.deck.pop() for _ in range(num)]
+        self.community_cards.extend(dealt)
+        # Each street is folded into every player's running evaluation once
+        ids = [c.id for c in dealt]
+        start = time.perf_counter()
+        updated = 0
+        for player in self.active_players:
+            if player.tracker is not None:
+                player.tracker.add(ids)
+                updated += 1
+        _TRACKER.observe(time.perf_counter() - start, updated)
+
+    def hand_tracker(self, player):
+        ## player's HandTracker for the current board, rebuilt from the hand
+        ## and board masks if the cards were changed without going through
+        ## the deal methods
+        tracker = player.tracker
+        mask = player.hand_mask | self.board_mask
+        if tracker is None or tracker.mask != mask:
+            tracker = player.tracker = hand_evaluator.HandTracker.from_mask(mask)
+        return tracker
 
     def evaluate_hand(self, player):
-        all_cards = player.hand + self.community_cards
-        return self._evaluate(all_cards)
+        if len(player.hand) + len(self.community_cards) >= 5:
+            return HandStrength.from_value(self.hand_tracker(player).value)
+        return self._evaluate(player.hand + self.community_cards)
 
     def _evaluate(self, cards):
+        if len(cards) >= 5:
+            return HandStrength.from_value(HandEvaluator.evaluate_hand(cards_mask(cards), 0))
         # Convert ranks to their numerical values
         ranks = sorted([card.rank.value[0] for card in cards], reverse=True)
         return HandStrength(0, ranks)
 
+    def hand_equity(self, player, samples=400):
+        ## Monte Carlo share of the pot against the players still in the hand
+        opponents = [p for p in self.active_players
+                     if p is not player and not getattr(p, 'folded', False)]
+        if not opponents:
+            return 1.0
+        if not self.community_cards:
+            # Preflop equity never changes: table lookup instead of sampling
+            return preflop_table.preflop_equity(player.hand, len(opponents))
+        # Suit-isomorphic spots across all tables share one cache entry
+        return equity_cache.cached_equity(player.hand, self.community_cards,
+                                          min(len(opponents), 9), samples)
+
     def ai_decision(self, player):
         if player.ai_level == 1:
-            return random.choice(['fold', 'call', 'raise'])
-        elif player.ai_level == 2:
-            hand_strength = self.evaluate_hand(player)
-            if hand_strength.strength > 3 or random.random() < 0.7:
-                return random.choice(['call', 'raise'])
-            else:
-                return 'fold'
-        else:
-            # Advanced AI logic
-            return 'call'
+            return self.rng.choice(['fold', 'call', 'raise'])
+        if player.ai_level >= 3:
+            # Precomputed push/fold strategy; spots outside it are played
+            # like level 2
+            action = strategy_table.decision(self, player)
+            if action is not None:
+                return action
+        if player.ai_level >= 2:
+            # Compare equity with an even share of the pot
+            opponents = len([p for p in self.active_players
+                             if p is not player and not getattr(p, 'folded', False)])
+            fair_share = 1.0 / (opponents + 1)
+            win_chance = self.hand_equity(player)
+            if win_chance > 1.5 * fair_share:
+                return 'raise'
+            if win_chance > 0.8 * fair_share or self.rng.random() < 0.1:
+                return 'call'
+            # Keep drawing to a flush or an open ended straight before the river
+            if self.community_cards and self.hand_tracker(player).outs >= 8:
+                return 'call'
+            return 'fold'
+        return 'call'
 
     def betting_round(self, start_player_index=0):
 
@@ -366,6 +500,241 @@ class PokerGame:
             if all(p.current_bet == self.current_bet for p in active_players):
                 round_complete = True
 
+    def start_hand(self, max_raises=4):
+        ## Start a hand: rotate the dealer, post blinds, deal and open
+        ## pre-flop betting. Raises are capped at max_raises per street.
+        ## Returns False if fewer than two players have chips.
+        self.active_players = [p for p in self.players if p.chips > 0]
+        if len(self.active_players) < 2:
+            return False
+
+        # Two hole cards each and a full board is all a hand can deal
+        self.new_deck(2 * len(self.active_players) + 5)
+        self.pot = 0
+        for player in self.players:
+            player.hand = []
+            player.current_bet = 0
+            player.total_bet = 0
+            player.folded = player.chips <= 0
+
+        num_active = len(self.active_players)
+        self.dealer_position = (self.dealer_position + 1) % num_active
+        self._bet(self.active_players[(self.dealer_position + 1) % num_active], self.small_blind)
+        self._bet(self.active_players[(self.dealer_position + 2) % num_active], self.big_blind)
+        self.current_bet = self.big_blind
+        self.current_phase = GamePhase.PREFLOP
+        self.max_raises = max_raises
+        self.deal_hole_cards()
+        self._open_street(self.dealer_position + 3)
+        self.hand_number += 1
+        if self.recorder is not None:
+            # Blinds and hole cards are in the state, as is the deck order
+            self._record('start', state=self.export_state())
+        return True
+
+    def _record(self, kind, **fields):
+        if self.recorder is not None:
+            fields['hand'] = self.hand_number
+            self.recorder(kind, fields)
+
+    def _open_street(self, first_to_act):
+        ## Everyone still in with chips acts at least once per street
+        self.raises = 0
+        self.needs_action = [p for p in self.active_players if not p.folded and p.chips > 0]
+        self._next_to_act(first_to_act)
+
+    def _next_to_act(self, index):
+        num_active = len(self.active_players)
+        for offset in range(num_active):
+            player = self.active_players[(index + offset) % num_active]
+            if player in self.needs_action:
+                self.action_index = (index + offset) % num_active
+                self.current_player = player
+                return
+        self.current_player = None
+
+    def _bet(self, player, amount):
+        amount = min(amount, player.chips)
+        player.chips -= amount
+        player.current_bet += amount
+        player.total_bet += amount
+        self.pot += amount
+
+    @property
+    def street_complete(self):
+        return not self.needs_action or len([p for p in self.active_players if not p.folded]) <= 1
+
+    def apply_action(self, player, action, amount=None):
+        ## Apply the current player's 'fold', 'call', 'raise' or 'all_in'. A
+        ## raise puts in `amount` chips, at least a call plus one big blind;
+        ## once the street's raises are used up it counts as a call. 'all_in'
+        ## is a raise of every chip the player has.
+        ## Everything is checked before the table changes, so a bad action
+        ## leaves the hand exactly as it was.
+        if player is not self.current_player or player not in self.needs_action:
+            raise ValueError(f"It is not {player.name}'s turn")
+        if action not in ACTIONS:
+            raise ValueError(f"Unknown action: {action}")
+        if amount is not None and (not isinstance(amount, int) or isinstance(amount, bool)
+                                   or amount < 0):
+            raise ValueError(f"Bad amount: {amount!r}")
+        if action == 'all_in':
+            action, amount = 'raise', player.chips
+        self.needs_action.remove(player)
+        to_call = self.current_bet - player.current_bet
+        bet_before = player.current_bet
+
+        if action == 'raise' and self.raises < self.max_raises and player.chips > to_call:
+            self._bet(player, max(amount or 0, to_call + self.big_blind))
+            self.current_bet = player.current_bet
+            self.raises += 1
+            # A raise re-opens the action for everyone else
+            self.needs_action = [p for p in self.active_players
+                                 if p is not player and not p.folded and p.chips > 0]
+        elif action == 'fold' and to_call > 0:
+            player.folded = True
+        else:
+            # call, check, or a raise that is capped
+            self._bet(player, to_call)
+
+        if self.recorder is not None:
+            self._record('action', seat=self.players.index(player), action=action,
+                         amount=player.current_bet - bet_before)
+        if self.street_complete:
+            self.current_player = None
+        else:
+            self._next_to_act(self.action_index + 1)
+
+    def next_street(self):
+        ## Deal the next street once betting is complete. Goes straight to
+        ## showdown after the river or when only one player is left.
+        if len([p for p in self.active_players if not p.folded]) <= 1 or \
+                self.current_phase == GamePhase.RIVER:
+            self.current_phase = GamePhase.SHOWDOWN
+            self.current_player = None
+            return
+        self.advance_phase()
+        for player in self.active_players:
+            player.current_bet = 0
+        self.current_bet = 0
+        self._open_street(self.dealer_position + 1)
+        if self.recorder is not None:
+            self._record('board', phase=self.current_phase.name,
+                         cards=[c.id for c in self.community_cards])
+
+    def showdown(self):
+        ## Build the main and side pots and settle them without touching any
+        ## chips. Live hands are ranked from their trackers, already evaluated
+        ## as the board was dealt, and that ranking is reused for every pot. Returns (pots, {player: chips won}).
+        num_active = len(self.active_players)
+        order = [self.active_players[(self.dealer_position + 1 + i) % num_active]
+                 for i in range(num_active)]
+        live = [p for p in order if not p.folded]
+        if len(live) > 1:
+            start = time.perf_counter()
+            strengths = {p: self.hand_tracker(p).value for p in live}
+            _SHOWDOWN.observe(time.perf_counter() - start, len(live))
+        else:
+            strengths = {live[0]: 0}
+        side_pots = pots.build_pots({p: p.total_bet for p in order}, live)
+        return side_pots, pots.award(side_pots, strengths)
+
+    def finish_hand(self):
+        ## Pay out the main and side pots and return every player who won
+        ## chips, in odd-chip order
+        side_pots, payouts = self.showdown()
+        self.last_pots = side_pots
+        winners = []
+        for pot in side_pots:
+            for winner in pot.winners:
+                if winner not in winners:
+                    winners.append(winner)
+        if self.recorder is not None:
+            shown = [p for p in self.active_players if not p.folded]
+            self._record('showdown', pot=self.pot,
+                         winners=[self.players.index(w) for w in winners],
+                         pots=[[pot.amount, [self.players.index(w) for w in pot.winners]]
+                               for pot in side_pots],
+                         shown={self.players.index(p): [c.id for c in p.hand] for p in shown}
+                         if len(shown) > 1 else {})
+        for player, amount in payouts.items():
+            player.chips += amount
+        self.pot = 0
+        return winners
+
+    def play_hand(self, policy=None, max_raises=4):
+        ## Play one complete hand with no I/O. policy(game, player) returns
+        ## 'fold', 'call' or 'raise' and defaults to ai_decision.
+        ## Returns the winners, or [] if fewer than two players have chips.
+        if not self.start_hand(max_raises):
+            return []
+        policy = policy or PokerGame.ai_decision
+        while self.current_phase != GamePhase.SHOWDOWN:
+            if self.street_complete:
+                self.next_street()
+            else:
+                self.apply_action(self.current_player, policy(self, self.current_player))
+        return self.finish_hand()
+
+    def export_state(self):
+        ## Compact, JSON friendly copy of the table: cards as ids, players
+        ## referenced by seat index. load_state() puts it back.
+        seat = {id(p): i for i, p in enumerate(self.players)}
+        return {
+            'players': [[p.name, p.chips, p.ai_level, [c.id for c in p.hand], p.current_bet,
+                         getattr(p, 'folded', False), p.total_bet] for p in self.players],
+            'deck': [c.id for c in self.deck],
+            'board': [c.id for c in self.community_cards],
+            'pot': self.pot,
+            'current_bet': self.current_bet,
+            'blinds': [self.small_blind, self.big_blind],
+            'dealer_position': self.dealer_position,
+            'phase': self.current_phase.name,
+            'active': [seat[id(p)] for p in self.active_players],
+            'needs_action': [seat[id(p)] for p in self.needs_action],
+            'current_player': seat.get(id(self.current_player)),
+            'action_index': self.action_index,
+            'raises': [self.raises, self.max_raises],
+            'hand_number': self.hand_number,
+        }
+
+    def copy(self, rng=None):
+        ## Detached copy of the table on copies of its players, for reading
+        ## it without the table's lock, e.g. an AI decision on another thread
+        players = [Player(p.name, p.chips, p.ai_level) for p in self.players]
+        game = PokerGame(players, rng=rng, headless=True)
+        game.load_state(self.export_state())
+        return game
+
+    def load_state(self, state):
+        ## Restore export_state() output onto this game's players, which
+        ## must be seated in the same order
+        for player, (name, chips, ai_level, hand, current_bet, folded, total_bet) in zip(self.players, state['players']):
+            player.name = name
+            player.chips = chips
+            player.ai_level = ai_level
+            player.hand = [CARDS[c] for c in hand]
+            player.current_bet = current_bet
+            player.folded = folded
+            player.total_bet = total_bet
+        self.deck = [CARDS[c] for c in state['deck']]
+        self.community_cards = [CARDS[c] for c in state['board']]
+        board = self.board_mask
+        for player in self.players:
+            player.tracker = hand_evaluator.HandTracker.from_mask(player.hand_mask | board)
+        self.pot = state['pot']
+        self.current_bet = state['current_bet']
+        self.small_blind, self.big_blind = state['blinds']
+        self.dealer_position = state['dealer_position']
+        self.current_phase = GamePhase[state['phase']]
+        self.active_players = [self.players[i] for i in state['active']]
+        self.needs_action = [self.players[i] for i in state['needs_action']]
+        current = state['current_player']
+        self.current_player = self.players[current] if current is not None else None
+        self.action_index = state['action_index']
+        self.raises, self.max_raises = state['raises']
+        self.hand_number = state.get('hand_number', 0)
+
     def play_round(self):
 
         if not self.active_players:
@@ -403,7 +772,7 @@ class PokerGame:
         
         evaluations = []
         for player in active_players:
-            strength = HandEvaluator.evaluate_hand(player.hand, self.community_cards)
+            strength = self.hand_tracker(player).value
             evaluations.append((player, strength))
         
         evaluations.sort(key=lambda x: x[1], reverse=True)
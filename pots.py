@@ -0,0 +1,55 @@
+# pots.py
+# Main and side pots from what each player put in over the hand.
+#
+# Every distinct contribution level of a player still in the hand closes a
+# pot: each contributor adds up to that level, and only live players who
+# reached it can win it. Chips folded players put in above the top level
+# go to the last pot. Hands are ranked once by the caller and the same
+# ranking settles every pot.
+
+
+class Pot:
+    __slots__ = ('amount', 'eligible', 'winners')
+
+    def __init__(self, amount, eligible):
+        self.amount = amount
+        self.eligible = eligible
+        self.winners = []
+
+    def __repr__(self):
+        return f"Pot({self.amount}, {self.eligible})"
+
+
+def build_pots(contributions, live):
+    ## contributions: {player: chips put in this hand}, folded players
+    ## included. live: players still in, in odd-chip order (left of the
+    ## dealer first). Returns the main pot followed by the side pots.
+    pots = []
+    previous = 0
+    for level in sorted({contributions[p] for p in live}):
+        amount = sum(min(c, level) - min(c, previous) for c in contributions.values())
+        if amount:
+            pots.append(Pot(amount, [p for p in live if contributions[p] >= level]))
+        previous = level
+
+    excess = sum(c - previous for c in contributions.values() if c > previous)
+    if excess:
+        if pots:
+            pots[-1].amount += excess
+        else:
+            pots.append(Pot(excess, list(live)))
+    return pots
+
+
+def award(pots, strengths):
+    ## Split each pot among its best eligible hands. strengths maps every
+    ## live player to a comparable strength. Odd chips go to the earliest
+    ## winners in eligible order. Returns {player: chips won}.
+    payouts = {}
+    for pot in pots:
+        best = max(strengths[p] for p in pot.eligible)
+        pot.winners = [p for p in pot.eligible if strengths[p] == best]
+        share, odd_chips = divmod(pot.amount, len(pot.winners))
+        for i, winner in enumerate(pot.winners):
+            payouts[winner] = payouts.get(winner, 0) + share + (1 if i < odd_chips else 0)
+    return payouts
@@ -0,0 +1,143 @@
+# preflop_table.py
+# Precomputed preflop equity for the 169 starting hand classes against 1-9
+# random opponents.
+#
+# Build offline (takes a while, spreads over worker processes):
+#     python preflop_table.py build --samples 50000 --workers 8
+#
+# File layout, little endian:
+#     header  '<4sHHHI' magic, version, classes, max opponents, samples/cell
+#     body    classes * max opponents uint16, equity scaled to 0-65535,
+#             row = hand class, column = opponents - 1
+#
+# At runtime the file is memory-mapped, so loading costs nothing and every
+# lookup is a single unpack. Without a file, lookups fall back to sampling
+# on demand and memoize the answer.
+
+import argparse
+import os
+import struct
+import threading
+
+import equity
+import hand_evaluator
+import mmap_table
+
+MAGIC = b'PFEQ'
+VERSION = 1
+NUM_CLASSES = 169
+MAX_OPPONENTS = 9
+_HEADER = struct.Struct('<4sHHHI')
+_CELL = struct.Struct('<H')
+_SCALE = 65535
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'preflop_equity.bin')
+RANK_CHARS = '23456789TJQKA'
+
+
+def hand_class(first, second):
+    ## Canonical class 0-168 of two hole cards (Card objects or ids).
+    ## Pairs sit on the diagonal of a 13x13 grid, suited hands above it
+    ## (high rank row) and offsuit hands below it (low rank row).
+    a, b = equity.card_ids((first, second))
+    high, low = max(a % 13, b % 13), min(a % 13, b % 13)
+    if a // 13 == b // 13:
+        return high * 13 + low
+    return low * 13 + high
+
+
+def class_name(index):
+    row, col = divmod(index, 13)
+    if row == col:
+        return RANK_CHARS[row] * 2
+    if row > col:
+        return RANK_CHARS[row] + RANK_CHARS[col] + 's'
+    return RANK_CHARS[col] + RANK_CHARS[row] + 'o'
+
+
+def representative(index):
+    ## Concrete hole cards (ids) for a class
+    row, col = divmod(index, 13)
+    if row == col:
+        return [hand_evaluator.card_id(row, 0), hand_evaluator.card_id(row, 1)]
+    if row > col:
+        return [hand_evaluator.card_id(row, 0), hand_evaluator.card_id(col, 0)]
+    return [hand_evaluator.card_id(col, 0), hand_evaluator.card_id(row, 1)]
+
+
+def build(path=DEFAULT_PATH, samples=50000, workers=1, seed=169):
+    ## Sample every cell and write the table atomically
+    cells = []
+    for index in range(NUM_CLASSES):
+        for opponents in range(1, MAX_OPPONENTS + 1):
+            result = equity.equity(representative(index), num_opponents=opponents,
+                                   samples=samples, workers=workers,
+                                   seed=seed * 1000 + index * 10 + opponents)
+            cells.append(round(result.equity * _SCALE))
+        print(f"{class_name(index):>4} {cells[-MAX_OPPONENTS] / _SCALE:.3f}")
+
+    mmap_table.write(path, _HEADER.pack(MAGIC, VERSION, NUM_CLASSES, MAX_OPPONENTS, samples),
+                     struct.pack(f'<{len(cells)}H', *cells))
+
+
+class PreflopTable:
+    def __init__(self, path=DEFAULT_PATH, fallback_samples=3000):
+        self.path = path
+        self.fallback_samples = fallback_samples
+        self._map = None
+        self._computed = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        ## Map the file if present; a missing or stale file leaves the table
+        ## in on-demand mode instead of failing startup
+        def valid(fields, size):
+            return fields[:4] == (MAGIC, VERSION, NUM_CLASSES, MAX_OPPONENTS) and \
+                size == _HEADER.size + NUM_CLASSES * MAX_OPPONENTS * _CELL.size
+
+        mapped = mmap_table.open_map(self.path, _HEADER, valid)
+        if mapped is None:
+            return False
+        self._map = mapped[0]
+        return True
+
+    @property
+    def loaded(self):
+        return self._map is not None
+
+    def equity(self, first, second, opponents):
+        ## Equity of two hole cards against `opponents` random hands
+        opponents = min(max(opponents, 1), MAX_OPPONENTS)
+        index = hand_class(first, second)
+        if self._map is not None:
+            offset = _HEADER.size + (index * MAX_OPPONENTS + opponents - 1) * _CELL.size
+            return _CELL.unpack_from(self._map, offset)[0] / _SCALE
+
+        key = (index, opponents)
+        value = self._computed.get(key)
+        if value is None:
+            value = equity.equity(representative(index), num_opponents=opponents,
+                                  samples=self.fallback_samples,
+                                  seed=index * 10 + opponents).equity
+            with self._lock:
+                self._computed[key] = value
+        return value
+
+
+# Shared table, opened on first use
+get_table = mmap_table.Shared(PreflopTable).get
+
+
+def preflop_equity(hole_cards, opponents):
+    return get_table().equity(hole_cards[0], hole_cards[1], opponents)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the preflop equity table')
+    parser.add_argument('command', choices=['build'])
+    parser.add_argument('--path', default=DEFAULT_PATH)
+    parser.add_argument('--samples', type=int, default=50000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    build(args.path, args.samples, args.workers)
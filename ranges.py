@@ -0,0 +1,311 @@
+# ranges.py
+# Hand range notation and range-vs-range equity.
+#
+# A range is a comma separated list of tokens, each optionally weighted
+# with ":weight" (0-1, default 1):
+#     QQ  QQ+  22-55          pairs: one, that and better, a span
+#     AKs AKo AK              suited, offsuit, both
+#     A2s+  KTo+  K9s-K6s     raise the kicker up to the card below the top
+#                             one, or a span of kickers under one top card
+#     AhKh                    one exact combo
+# parse_range() expands a range to (card, card, weight) combos on card ids.
+# Combos are keyed by their 52 bit card mask, so a combo named twice is
+# counted once (the later weight wins) and combos using dead cards drop out.
+#
+# range_equity() runs both ranges out over every board, or a sample of
+# boards when there are too many to enumerate. On a board each combo of
+# each range is evaluated once and that score is shared by all matchups it
+# takes part in: villain scores are sorted with running weights, so a hero
+# combo resolves its whole row of the matrix with two bisects, and only
+# the few villain combos that share a card with it are taken back out.
+# Boards go out in batches like equity.equity(), seeded per batch and
+# folded in index order, so the answer does not depend on `workers`.
+#
+#     python ranges.py "JJ+,AKs" "22+,A2s+" --samples 20000 --workers 4
+
+import argparse
+import bisect
+import itertools
+import math
+import random
+import time
+
+from equity import card_ids, run_batches
+from hand_evaluator import _RANK_KEY, card_id, evaluate_key
+from preflop_table import RANK_CHARS, class_name, hand_class
+
+SUIT_CHARS = 'hdcs'  # in poker_logic.Suit order
+
+
+def _rank(char, token):
+    index = RANK_CHARS.find(char.upper())
+    if index < 0:
+        raise ValueError(f"Bad range token: {token}")
+    return index
+
+
+def _pair_combos(rank):
+    cards = [card_id(rank, suit) for suit in range(4)]
+    return list(itertools.combinations(cards, 2))
+
+
+def _two_rank_combos(high, low, kind):
+    combos = []
+    for first in range(4):
+        for second in range(4):
+            if (kind == 's' and first != second) or (kind == 'o' and first == second):
+                continue
+            combos.append((card_id(high, first), card_id(low, second)))
+    return combos
+
+
+def _token_combos(token):
+    ## Hole card pairs (ids) named by one token, weight already stripped
+    if len(token) == 4 and token[1].lower() in SUIT_CHARS and token[3].lower() in SUIT_CHARS:
+        a = card_id(_rank(token[0], token), SUIT_CHARS.index(token[1].lower()))
+        b = card_id(_rank(token[2], token), SUIT_CHARS.index(token[3].lower()))
+        if a == b:
+            raise ValueError(f"Bad range token: {token}")
+        return [(a, b)]
+
+    span = token.split('-')
+    if len(span) > 2:
+        raise ValueError(f"Bad range token: {token}")
+    plus = span[0].endswith('+')
+    first = span[0].rstrip('+')
+    if len(first) not in (2, 3) or (len(span) == 2 and plus):
+        raise ValueError(f"Bad range token: {token}")
+    high, low = _rank(first[0], token), _rank(first[1], token)
+    kind = first[2].lower() if len(first) == 3 else ''
+    if kind not in ('', 's', 'o'):
+        raise ValueError(f"Bad range token: {token}")
+
+    if high == low:
+        if kind:
+            raise ValueError(f"Bad range token: {token}")
+        top = 12 if plus else high
+        if len(span) == 2:
+            last = span[1]
+            if len(last) != 2 or last[0] != last[1]:
+                raise ValueError(f"Bad range token: {token}")
+            top = _rank(last[0], token)
+        ranks = range(min(high, top), max(high, top) + 1)
+        return [combo for rank in ranks for combo in _pair_combos(rank)]
+
+    if low > high:
+        high, low = low, high
+    kickers = [low]
+    if plus:
+        kickers = range(low, high)
+    elif len(span) == 2:
+        last = span[1]
+        if len(last) != len(first) or _rank(last[0], token) != high \
+                or last[2:].lower() != kind:
+            raise ValueError(f"Bad range token: {token}")
+        end = _rank(last[1], token)
+        kickers = range(min(low, end), max(low, end) + 1)
+    return [combo for kicker in kickers for combo in _two_rank_combos(high, kicker, kind)]
+
+
+def parse_range(text, dead=()):
+    ## Expand range notation to a list of (card id, card id, weight),
+    ## without combos that use a dead card
+    dead_mask = 0
+    for c in card_ids(dead):
+        dead_mask |= 1 << c
+    combos = {}  # card mask -> combo, so each combo is only there once
+    for token in text.replace(' ', '').split(','):
+        if not token:
+            continue
+        name, _, weight = token.partition(':')
+        weight = float(weight) if weight else 1.0
+        if not 0.0 <= weight <= 1.0:
+            raise ValueError(f"Bad range weight: {token}")
+        for a, b in _token_combos(name):
+            mask = (1 << a) | (1 << b)
+            if mask & dead_mask:
+                continue
+            if weight:
+                combos[mask] = (a, b, weight)
+            else:
+                combos.pop(mask, None)
+    return list(combos.values())
+
+
+def combo_name(a, b):
+    ## "AhKh", higher card first
+    if a % 13 < b % 13:
+        a, b = b, a
+    return RANK_CHARS[a % 13] + SUIT_CHARS[a // 13] + RANK_CHARS[b % 13] + SUIT_CHARS[b // 13]
+
+
+class RangeEquityResult:
+    def __init__(self, hero, totals, elapsed, seed, exhaustive):
+        self.hero = hero
+        equity_sums, weight_sums, win, tie, matched, self.boards, self.evaluations, \
+            self.matchups = totals
+        self.equity = sum(equity_sums) / matched if matched else 0.0
+        self.win = win / matched if matched else 0.0
+        self.tie = tie / matched if matched else 0.0
+        # Hero combo -> its equity against the villain range (per combo weights)
+        self.combo_equity = {
+            combo_name(a, b): e / w
+            for (a, b, _), e, w in zip(hero, equity_sums, weight_sums) if w
+        }
+        self._sums = equity_sums, weight_sums
+        self.elapsed = elapsed
+        self.combos_per_sec = self.evaluations / elapsed if elapsed > 0 else float('inf')
+        self.matchups_per_sec = self.matchups / elapsed if elapsed > 0 else float('inf')
+        self.seed = seed
+        self.exhaustive = exhaustive
+
+    def class_equity(self):
+        ## Hero equity per starting hand class, e.g. {'AKs': 0.61, 'QQ': 0.72}
+        equity_sums, weight_sums = {}, {}
+        for (a, b, _), e, w in zip(self.hero, *self._sums):
+            index = hand_class(a, b)
+            equity_sums[index] = equity_sums.get(index, 0.0) + e
+            weight_sums[index] = weight_sums.get(index, 0.0) + w
+        return {class_name(i): equity_sums[i] / w for i, w in weight_sums.items() if w}
+
+    def __repr__(self):
+        how = 'all' if self.exhaustive else 'sampled'
+        return (f"RangeEquityResult(equity={self.equity:.4f}, win={self.win:.4f}, "
+                f"tie={self.tie:.4f}, boards={self.boards} {how}, "
+                f"{self.combos_per_sec:,.0f} combos/s, {self.matchups_per_sec:,.0f} matchups/s)")
+
+
+def _live(combos, board_mask, board_key):
+    ## (index, score, weight) of the combos not blocked by the board
+    live = []
+    for index, (a, b, weight) in enumerate(combos):
+        mask = (1 << a) | (1 << b)
+        if not mask & board_mask:
+            live.append((index, evaluate_key(board_key + _RANK_KEY[a] + _RANK_KEY[b],
+                                             board_mask | mask), weight))
+    return live
+
+
+def range_batch(hero, villain, board, boards, count, seed):
+    ## Score `boards` (lists of the missing cards), or `count` random ones
+    ## when boards is None. Returns the per batch totals folded by
+    ## range_equity().
+    villain_masks = [(1 << a) | (1 << b) for a, b, _ in villain]
+    conflicts = [[j for j, mask in enumerate(villain_masks) if mask & ((1 << a) | (1 << b))]
+                 for a, b, _ in hero]
+    base_key = sum(_RANK_KEY[c] for c in board)
+    base_mask = 0
+    for c in board:
+        base_mask |= 1 << c
+    if boards is None:
+        rng = random.Random(seed)
+        deck = [c for c in range(52) if not base_mask >> c & 1]
+        missing = 5 - len(board)
+        boards = (rng.sample(deck, missing) for _ in range(count))
+
+    equity_sums = [0.0] * len(hero)
+    weight_sums = [0.0] * len(hero)
+    win = tie = matched = 0.0
+    scored = evaluations = matchups = 0
+    for cards in boards:
+        key, mask = base_key, base_mask
+        for c in cards:
+            key += _RANK_KEY[c]
+            mask |= 1 << c
+        scored += 1
+        heroes = _live(hero, mask, key)
+        villains = _live(villain, mask, key)
+        evaluations += len(heroes) + len(villains)
+        if not heroes or not villains:
+            continue
+
+        villains.sort(key=lambda v: v[1])
+        scores = [v[1] for v in villains]
+        below = [0.0]  # below[i]: weight of villains[:i]
+        for v in villains:
+            below.append(below[-1] + v[2])
+        villain_score = {v[0]: v[1] for v in villains}
+        villain_weight = {v[0]: v[2] for v in villains}
+
+        for index, score, weight in heroes:
+            lo = bisect.bisect_left(scores, score)
+            hi = bisect.bisect_right(scores, score)
+            beaten, tied, total = below[lo], below[hi] - below[lo], below[-1]
+            pairs = len(villains)
+            for j in conflicts[index]:
+                other = villain_score.get(j)
+                if other is None:
+                    continue
+                w = villain_weight[j]
+                total -= w
+                pairs -= 1
+                if other < score:
+                    beaten -= w
+                elif other == score:
+                    tied -= w
+            matchups += pairs
+            equity_sums[index] += weight * (beaten + tied / 2)
+            weight_sums[index] += weight * total
+            win += weight * beaten
+            tie += weight * tied
+            matched += weight * total
+    return equity_sums, weight_sums, win, tie, matched, scored, evaluations, matchups
+
+
+def range_equity(hero, villain, board=(), samples=20000, max_boards=20000, workers=1,
+                 seed=None, batch_size=500):
+    ## Equity of range `hero` against range `villain` (notation or parsed
+    ## combos). Every run-out is enumerated when there are at most
+    ## max_boards of them, otherwise `samples` boards are drawn.
+    board = card_ids(board)
+    if len(board) > 5 or len(set(board)) != len(board):
+        raise ValueError("Board has at most 5 distinct cards")
+    if isinstance(hero, str):
+        hero = parse_range(hero, dead=board)
+    if isinstance(villain, str):
+        villain = parse_range(villain, dead=board)
+    if not hero or not villain:
+        raise ValueError("Empty range")
+    if seed is None:
+        seed = random.getrandbits(32)
+
+    missing = 5 - len(board)
+    deck = [c for c in range(52) if c not in board]
+    exhaustive = math.comb(len(deck), missing) <= max_boards
+    if exhaustive:
+        every = list(itertools.combinations(deck, missing))
+        jobs = [(every[i:i + batch_size], 0) for i in range(0, len(every), batch_size)]
+    else:
+        jobs = [(None, min(batch_size, samples - i)) for i in range(0, samples, batch_size)]
+
+    totals = [[0.0] * len(hero), [0.0] * len(hero), 0.0, 0.0, 0.0, 0, 0, 0]
+
+    def add(batch):
+        for i in range(2):
+            totals[i] = [x + y for x, y in zip(totals[i], batch[i])]
+        for i in range(2, len(totals)):
+            totals[i] += batch[i]
+
+    start = time.perf_counter()
+    for batch in run_batches(range_batch, [(hero, villain, board, boards, count)
+                                           for boards, count in jobs], seed, workers):
+        add(batch)
+    return RangeEquityResult(hero, totals, time.perf_counter() - start, seed, exhaustive)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Range vs range equity')
+    parser.add_argument('hero', help='e.g. "JJ+,AKs"')
+    parser.add_argument('villain', help='e.g. "22+,A2s+"')
+    parser.add_argument('--board', default='', help='e.g. "Ah7d2c"')
+    parser.add_argument('--samples', type=int, default=20000)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    board = [card_id(_rank(args.board[i], args.board), SUIT_CHARS.index(args.board[i + 1].lower()))
+             for i in range(0, len(args.board), 2)]
+    result = range_equity(args.hero, args.villain, board, args.samples, workers=args.workers,
+                          seed=args.seed)
+    print(result)
+    for name, value in sorted(result.class_equity().items(), key=lambda item: -item[1]):
+        print(f"{name:>4}  {value:.4f}")
@@ -0,0 +1,256 @@
+# registry.py
+# Sharded registry of live game sessions.
+#
+# Tables are spread over a fixed number of shards by game_id, each with
+# its own small dict and lock. A shard lock is only held for the dict
+# operation itself, never while a table is being played; table state is
+# guarded by the session's own lock. Work on one table therefore never
+# waits on another, and create/lookup/remove on different shards never
+# contend.
+#
+# Idle tables are swept by sweep(). A table nobody has joined is evicted
+# outright. A joined table is hibernated: its compact snapshot goes to the
+# table store and it is rehydrated on its next lookup. Hibernated tables
+# idle past evict_ttl are dropped too. max_live bounds the number of live
+# tables; past it the least recently active ones are hibernated or evicted
+# first.
+#
+# max_live is a count, not a memory budget. A live table is bounded in size
+# (at most 10 seats, a 52 card deck and a fixed ring of published events),
+# around 12 KB fresh and a few times that once its event ring is full, so
+# the count is set from the memory a worker may spend on tables divided by
+# that, checked against the RSS loadtest.py reports. Hibernated tables cost
+# only their placeholder here; their snapshots live in the store.
+#
+# With a durable store (see table_store) every table is also written through
+# after each locked() block, and lookups of tables this process has never
+# seen fall back to the store, so worker processes can hand tables over.
+#
+# Sessions stored here need game_id, lock, last_active, retired,
+# is_joined() and to_snapshot(); restore(blob) must rebuild one.
+
+import time
+from contextlib import contextmanager
+from threading import Lock
+
+import metrics
+from table_store import MemoryStore
+
+_lock_wait = metrics.histogram('poker_registry_lock_wait_seconds',
+                               'Time spent waiting for registry locks', ['lock'])
+_SHARD_WAIT = _lock_wait.labels('shard')
+_TABLE_WAIT = _lock_wait.labels('table')
+
+
+class HibernatedTable:
+    ## Placeholder for a table whose snapshot is in the store
+    __slots__ = ('last_active',)
+
+    def __init__(self, last_active):
+        self.last_active = last_active
+
+
+class GameRegistry:
+    def __init__(self, shards=32, restore=None, idle_ttl=600, evict_ttl=86400, max_live=None,
+                 store=None):
+        self.store = store if store is not None else MemoryStore()
+        self._shards = [{} for _ in range(shards)]
+        self._locks = [Lock() for _ in range(shards)]
+        self.restore = restore
+        self.idle_ttl = idle_ttl
+        self.evict_ttl = evict_ttl
+        self.max_live = max_live
+        self.hibernated_total = 0
+        self.rehydrated_total = 0
+        self.evicted_total = 0
+
+    def _shard(self, game_id):
+        index = hash(game_id) % len(self._shards)
+        return self._shards[index], self._locks[index]
+
+    def add(self, game_id, session):
+        tables, lock = self._shard(game_id)
+        with lock:
+            tables[game_id] = session
+        if self.store.durable:
+            self.store.save(game_id, session.to_snapshot())
+
+    def _lookup(self, tables, game_id):
+        ## (entry, blob) for game_id, blob being the snapshot to restore when
+        ## the table is hibernated or only in the store; caller holds the
+        ## shard lock
+        entry = tables.get(game_id)
+        if entry is not None and not isinstance(entry, HibernatedTable):
+            return entry, None
+        if entry is None and not self.store.durable:
+            return None, None
+        blob = self.store.load(game_id)
+        if blob is None:
+            tables.pop(game_id, None)
+            return None, None
+        return entry, blob
+
+    def get(self, game_id, default=None):
+        ## Live session for game_id, rehydrating it if it was hibernated.
+        ## The snapshot is restored outside the shard lock and installed only
+        ## if the entry has not changed meanwhile; otherwise look again.
+        tables, lock = self._shard(game_id)
+        start = time.perf_counter()
+        with lock:
+            _SHARD_WAIT.observe(time.perf_counter() - start)
+            entry, blob = self._lookup(tables, game_id)
+        while blob is not None:
+            session = self.restore(blob)
+            session.last_active = time.monotonic()
+            with lock:
+                if tables.get(game_id) is entry:
+                    tables[game_id] = session
+                    self.rehydrated_total += 1
+                    return session
+                entry, blob = self._lookup(tables, game_id)
+        return default if entry is None else entry
+
+    def peek(self, game_id):
+        ## Live session for game_id, or None if missing or hibernated
+        tables, lock = self._shard(game_id)
+        with lock:
+            entry = tables.get(game_id)
+        return None if isinstance(entry, HibernatedTable) else entry
+
+    @contextmanager
+    def locked(self, game_id):
+        ## Yield the session for game_id holding its lock, or None. Retries
+        ## if the session was hibernated between lookup and locking.
+        while True:
+            session = self.get(game_id)
+            if session is None:
+                yield None
+                return
+            start = time.perf_counter()
+            with session.lock:
+                _TABLE_WAIT.observe(time.perf_counter() - start)
+                if not session.retired:
+                    session.last_active = time.monotonic()
+                    with metrics.profiler.table(game_id):
+                        yield session
+                    if self.store.durable:
+                        self.store.save(game_id, session.to_snapshot())
+                    return
+
+    def remove(self, game_id):
+        tables, lock = self._shard(game_id)
+        with lock:
+            entry = tables.pop(game_id, None)
+        self.store.delete(game_id)
+        return entry
+
+    def __setitem__(self, game_id, session):
+        self.add(game_id, session)
+
+    def __getitem__(self, game_id):
+        session = self.get(game_id)
+        if session is None:
+            raise KeyError(game_id)
+        return session
+
+    def __contains__(self, game_id):
+        tables, lock = self._shard(game_id)
+        with lock:
+            if game_id in tables:
+                return True
+        return self.store.durable and game_id in self.store
+
+    def __len__(self):
+        return sum(len(tables) for tables in self._shards)
+
+    def items(self):
+        ## Snapshot of live (game_id, session) pairs, one shard at a time
+        pairs = []
+        for tables, lock in zip(self._shards, self._locks):
+            with lock:
+                pairs.extend((game_id, entry) for game_id, entry in tables.items()
+                             if not isinstance(entry, HibernatedTable))
+        return pairs
+
+    def values(self):
+        return [session for _, session in self.items()]
+
+    def _retire(self, game_id, session, now, force=False):
+        ## Hibernate or evict one live session. Its snapshot is taken and
+        ## saved without the shard lock, which is only held to swap the
+        ## entry. Sessions busy on another thread are left alone.
+        if not session.lock.acquire(blocking=False):
+            return False
+        try:
+            if not force and now - session.last_active < self.idle_ttl:
+                return False
+            session.retired = True
+            joined = session.is_joined()
+            if joined:
+                self.store.save(game_id, session.to_snapshot())
+            tables, lock = self._shard(game_id)
+            with lock:
+                entry = tables.get(game_id)
+                if entry is session:
+                    if joined:
+                        tables[game_id] = HibernatedTable(session.last_active)
+                    else:
+                        del tables[game_id]
+            if entry is session and joined:
+                self.hibernated_total += 1
+            elif entry is session or entry is None:
+                # Evicted, or removed while it was being saved
+                self.store.delete(game_id)
+                if entry is session:
+                    self.evicted_total += 1
+            return entry is session
+        finally:
+            session.lock.release()
+
+    def sweep(self, now=None):
+        ## Hibernate/evict idle tables, then enforce max_live. Shard locks
+        ## are only held to read and change the dicts; snapshots and store
+        ## writes happen after they are released.
+        now = time.monotonic() if now is None else now
+        live = []
+        idle = []
+        expired = []
+        for tables, lock in zip(self._shards, self._locks):
+            with lock:
+                for game_id, entry in list(tables.items()):
+                    if isinstance(entry, HibernatedTable):
+                        if now - entry.last_active >= self.evict_ttl:
+                            del tables[game_id]
+                            expired.append(game_id)
+                    elif now - entry.last_active >= self.idle_ttl:
+                        idle.append((game_id, entry))
+                    else:
+                        live.append((entry.last_active, game_id, entry))
+        for game_id in expired:
+            self.store.delete(game_id)
+            self.evicted_total += 1
+        for game_id, session in idle:
+            self._retire(game_id, session, now)
+
+        if self.max_live is not None and len(live) > self.max_live:
+            live.sort(key=lambda item: item[0])
+            for _, game_id, session in live[:len(live) - self.max_live]:
+                self._retire(game_id, session, now, force=True)
+
+    def stats(self):
+        live = hibernated = 0
+        for tables, lock in zip(self._shards, self._locks):
+            with lock:
+                for entry in tables.values():
+                    if isinstance(entry, HibernatedTable):
+                        hibernated += 1
+                    else:
+                        live += 1
+        return {
+            'live': live,
+            'hibernated': hibernated,
+            'evicted': self.evicted_total,
+            'hibernated_total': self.hibernated_total,
+            'rehydrated_total': self.rehydrated_total,
+            'stored': len(self.store),
+        }
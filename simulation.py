@@ -0,0 +1,106 @@
+# simulation.py
+# Headless self-play: complete hands between AI policies with no I/O.
+#
+# Each table gets its own random.Random stream derived from (seed, table),
+# so a run is reproducible and the result does not depend on how tables are
+# spread over worker processes. Stacks are reset to the starting amount
+# before every hand, so chip deltas measure how much each seat wins per hand.
+#
+#     python simulation.py --levels 1 2 2 --hands 10000 --tables 4 --workers 4
+
+import argparse
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from equity import batch_seed
+from poker_logic import Player, PokerGame
+
+
+class SimulationResult:
+    def __init__(self, ai_levels):
+        self.ai_levels = list(ai_levels)
+        self.hands = 0
+        self.showdowns = 0
+        self.chip_deltas = [0] * len(ai_levels)
+        self.wins = [0] * len(ai_levels)
+        self.elapsed = 0.0
+
+    @property
+    def hands_per_sec(self):
+        return self.hands / self.elapsed if self.elapsed > 0 else float('inf')
+
+    def deltas_by_level(self):
+        ## Average chips won per hand for each AI level
+        totals, seats = {}, {}
+        for level, delta in zip(self.ai_levels, self.chip_deltas):
+            totals[level] = totals.get(level, 0) + delta
+            seats[level] = seats.get(level, 0) + 1
+        return {level: totals[level] / seats[level] / max(self.hands, 1) for level in totals}
+
+    def merge(self, other):
+        self.hands += other.hands
+        self.showdowns += other.showdowns
+        self.chip_deltas = [a + b for a, b in zip(self.chip_deltas, other.chip_deltas)]
+        self.wins = [a + b for a, b in zip(self.wins, other.wins)]
+        return self
+
+    def __repr__(self):
+        return (f"SimulationResult(hands={self.hands}, showdowns={self.showdowns}, "
+                f"{self.hands_per_sec:.0f} hands/s, chip_deltas={self.chip_deltas})")
+
+
+def run_table(ai_levels, hands, seed, starting_chips=1000, policy=None):
+    ## Play `hands` hands at one table; top level so pools can pickle it
+    rng = random.Random(seed)
+    players = [Player(f"Seat {i + 1}", chips=starting_chips, ai_level=level)
+               for i, level in enumerate(ai_levels)]
+    game = PokerGame(players, rng=rng, headless=True)
+    result = SimulationResult(ai_levels)
+    start = time.perf_counter()
+    for _ in range(hands):
+        for player in players:
+            player.chips = starting_chips
+        winners = game.play_hand(policy)
+        result.hands += 1
+        if len([p for p in players if not p.folded]) > 1:
+            result.showdowns += 1
+        for i, player in enumerate(players):
+            result.chip_deltas[i] += player.chips - starting_chips
+            if player in winners:
+                result.wins[i] += 1
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+def simulate(ai_levels, hands, tables=1, workers=1, seed=0, starting_chips=1000, policy=None):
+    ## Play `hands` hands on each of `tables` tables, in-process or across
+    ## worker processes, and return the merged result. elapsed is wall time.
+    if len(ai_levels) < 2:
+        raise ValueError("Need at least 2 players")
+    start = time.perf_counter()
+    total = SimulationResult(ai_levels)
+    jobs = [(ai_levels, hands, batch_seed(seed, table), starting_chips, policy)
+            for table in range(tables)]
+    if workers <= 1 or tables == 1:
+        for job in jobs:
+            total.merge(run_table(*job))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for result in pool.map(run_table, *zip(*jobs)):
+                total.merge(result)
+    total.elapsed = time.perf_counter() - start
+    return total
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Headless AI self-play')
+    parser.add_argument('--levels', type=int, nargs='+', default=[1, 1, 2, 2])
+    parser.add_argument('--hands', type=int, default=1000, help='hands per table')
+    parser.add_argument('--tables', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    result = simulate(args.levels, args.hands, args.tables, args.workers, args.seed)
+    print(result)
+    print({level: round(delta, 2) for level, delta in result.deltas_by_level().items()})
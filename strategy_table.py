@@ -0,0 +1,398 @@
+# strategy_table.py
+# Precomputed heads-up push/fold strategy for ai_level 3.
+#
+# The abstraction: the small blind either folds or moves all in, and the
+# big blind facing that either folds or calls. Hands are bucketed into the
+# 169 starting hand classes and the effective stack into STACKS big blinds.
+# What each line wins or loses is read off the headless PokerGame rules
+# (blinds, all-in caps, pot settlement); showdown equity comes from a
+# sampled 169x169 class matrix. CFR+ solves every stack bucket and the
+# average strategies are written out.
+#
+# Build offline (takes a few minutes, spreads over worker processes):
+#     python strategy_table.py build --samples 200 --iterations 2000 --workers 8
+#
+# File layout, little endian:
+#     header  '<4sHHHHI' magic, version, classes, stack buckets, nodes, iterations
+#     stacks  stack buckets * uint16, effective stack in big blinds
+#     body    nodes * stack buckets * classes uint16, probability of going
+#             (or calling) all in scaled to 0-65535,
+#             index = (node * stack buckets + stack bucket) * classes + hand class
+#
+# At runtime the file is memory-mapped on the first decision that needs it,
+# and a decision is one unpack and one random number. Without a file, or
+# in spots outside the abstraction, level 3 plays like level 2.
+
+import argparse
+import bisect
+import itertools
+import os
+import random
+import struct
+import time
+
+from equity import run_batches
+from hand_evaluator import _RANK_KEY, evaluate_key
+import mmap_table
+from preflop_table import NUM_CLASSES, class_name, hand_class
+
+try:
+    import numpy as np
+except ImportError:  # only build() needs numpy
+    np = None
+
+MAGIC = b'PFST'
+VERSION = 1
+PUSH, CALL = range(2)  # nodes: small blind first in, big blind facing a push
+STACKS = (2, 3, 4, 5, 6, 7, 8, 10, 12, 15, 20, 25, 30)
+_HEADER = struct.Struct('<4sHHHHI')
+_CELL = struct.Struct('<H')
+_SCALE = 65535
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'push_fold_strategy.bin')
+
+
+def class_combos():
+    ## Hole card id pairs of every hand class
+    combos = [[] for _ in range(NUM_CLASSES)]
+    for a, b in itertools.combinations(range(52), 2):
+        combos[hand_class(a, b)].append((a, b))
+    return combos
+
+
+def equity_rows(rows, samples, seed):
+    ## Sampled equity of class i against every class j > i, for each i in
+    ## rows
+    combos = class_combos()
+    rng = random.Random(seed)
+    result = []
+    for i in rows:
+        row = []
+        for j in range(i + 1, NUM_CLASSES):
+            total = 0.0
+            for _ in range(samples):
+                a, b = rng.choice(combos[i])
+                c, d = rng.choice(combos[j])
+                while c in (a, b) or d in (a, b):
+                    c, d = rng.choice(combos[j])
+                used = (1 << a) | (1 << b) | (1 << c) | (1 << d)
+                key = mask = 0
+                dealt = 0
+                while dealt < 5:
+                    card = rng.randrange(52)
+                    bit = 1 << card
+                    if used & bit:
+                        continue
+                    used |= bit
+                    mask |= bit
+                    key += _RANK_KEY[card]
+                    dealt += 1
+                hero = evaluate_key(key + _RANK_KEY[a] + _RANK_KEY[b], mask | (1 << a) | (1 << b))
+                villain = evaluate_key(key + _RANK_KEY[c] + _RANK_KEY[d], mask | (1 << c) | (1 << d))
+                total += 1.0 if hero > villain else 0.5 if hero == villain else 0.0
+            row.append(total / samples)
+        result.append(row)
+    return result
+
+
+def equity_matrix(samples=200, workers=1, seed=21, batches=16):
+    ## E[i, j]: equity of class i against class j. Rows are dealt out to
+    ## `batches` seeded batches, so workers does not change the answer.
+    jobs = [list(range(k, NUM_CLASSES, batches)) for k in range(batches)]
+    results = list(run_batches(equity_rows, [(rows, samples) for rows in jobs], seed, workers))
+    matrix = np.full((NUM_CLASSES, NUM_CLASSES), 0.5)
+    for rows, values in zip(jobs, results):
+        for i, row in zip(rows, values):
+            matrix[i, i + 1:] = row
+            matrix[i + 1:, i] = 1.0 - np.array(row)
+    return matrix
+
+
+def deal_weights():
+    ## W[i, j]: chance that the small blind holds class i and the big blind
+    ## class j, counting only combos that share no card
+    combos = [(hand_class(a, b), (1 << a) | (1 << b)) for a, b in itertools.combinations(range(52), 2)]
+    weights = np.zeros((NUM_CLASSES, NUM_CLASSES))
+    for i, first in combos:
+        for j, second in combos:
+            if not first & second:
+                weights[i, j] += 1
+    return weights / weights.sum()
+
+
+def line_payoffs(stack, big_blind=100):
+    ## What the small blind wins, in big blinds, on each line with `stack`
+    ## big blinds each, played through PokerGame:
+    ## (fold, push and the big blind folds, pot when called, own stake in it)
+    from poker_logic import Player, PokerGame
+
+    def play(*actions):
+        game = PokerGame([Player('A', stack * big_blind), Player('B', stack * big_blind)],
+                         seed=0, headless=True)
+        game.small_blind, game.big_blind = big_blind // 2, big_blind
+        game.start_hand()
+        small = game.current_player
+        for action in actions:
+            game.apply_action(game.current_player, action)
+        return game, small
+
+    game, small = play('fold')
+    game.finish_hand()
+    fold = small.chips / big_blind - stack
+    game, small = play('all_in', 'fold')
+    game.finish_hand()
+    steal = small.chips / big_blind - stack
+    game, small = play('all_in', 'call')
+    return fold, steal, game.pot / big_blind, small.total_bet / big_blind
+
+
+def _matched(regrets):
+    ## Regret matching: probability of the aggressive action
+    total = regrets[:, 0] + regrets[:, 1]
+    return np.where(total > 0, regrets[:, 0] / np.where(total > 0, total, 1), 0.5)
+
+
+def solve(matrix, weights, payoffs, iterations=2000):
+    ## CFR+ with alternating updates over the push/fold game. Returns the
+    ## average (push, call) probabilities per class and the exploitability
+    ## of that pair in big blinds per hand.
+    fold, steal, pot, stake = payoffs
+    called = matrix * pot - stake  # small blind's result when called
+    held = weights.sum(axis=1)  # chance of each small blind class
+    push_regrets = np.zeros((NUM_CLASSES, 2))
+    call_regrets = np.zeros((NUM_CLASSES, 2))
+    push_sum = np.zeros(NUM_CLASSES)
+    call_sum = np.zeros(NUM_CLASSES)
+    call_reach = np.zeros(NUM_CLASSES)
+
+    def values(push, call):
+        ## Counterfactual values of each action for both players
+        push_value = (weights * (call * called + (1 - call) * steal)).sum(axis=1)
+        fold_value = held * fold
+        reach = weights * push[:, None]
+        call_value = -(reach * called).sum(axis=0)
+        fold_call_value = -reach.sum(axis=0) * steal
+        return push_value, fold_value, call_value, fold_call_value, reach.sum(axis=0)
+
+    for t in range(1, iterations + 1):
+        push, call = _matched(push_regrets), _matched(call_regrets)
+        push_value, fold_value, _, _, _ = values(push, call)
+        value = push * push_value + (1 - push) * fold_value
+        push_regrets[:, 0] = np.maximum(push_regrets[:, 0] + push_value - value, 0)
+        push_regrets[:, 1] = np.maximum(push_regrets[:, 1] + fold_value - value, 0)
+        push_sum += t * push
+
+        push = _matched(push_regrets)
+        _, _, call_value, fold_call_value, reach = values(push, call)
+        value = call * call_value + (1 - call) * fold_call_value
+        call_regrets[:, 0] = np.maximum(call_regrets[:, 0] + call_value - value, 0)
+        call_regrets[:, 1] = np.maximum(call_regrets[:, 1] + fold_call_value - value, 0)
+        call_sum += t * call * reach
+        call_reach += t * reach
+
+    push = push_sum / (iterations * (iterations + 1) / 2)
+    call = np.where(call_reach > 0, call_sum / np.where(call_reach > 0, call_reach, 1), 0.0)
+    push_value, fold_value, call_value, fold_call_value, _ = values(push, call)
+    # What best responses to the pair win for both players, halved; the
+    # big blind also collects the small blind's folds
+    exploitability = (np.maximum(push_value, fold_value).sum()
+                      + np.maximum(call_value, fold_call_value).sum()
+                      - (held * (1 - push)).sum() * fold) / 2
+    return push, call, exploitability
+
+
+def build(path=DEFAULT_PATH, samples=200, iterations=2000, workers=1, seed=21):
+    ## Solve every stack bucket and write the table atomically
+    if np is None:
+        raise ImportError("Building the strategy table needs numpy")
+    start = time.perf_counter()
+    matrix = equity_matrix(samples, workers, seed)
+    weights = deal_weights()
+    print(f"equity matrix: {time.perf_counter() - start:.1f}s")
+    pushes, calls = [], []
+    for stack in STACKS:
+        push, call, exploitability = solve(matrix, weights, line_payoffs(stack), iterations)
+        pushes.append(push)
+        calls.append(call)
+        print(f"{stack:>3}bb  push {push @ weights.sum(axis=1):.1%}  "
+              f"exploitability {exploitability * 1000:.2f} mbb/hand")
+
+    cells = np.concatenate(pushes + calls)
+    mmap_table.write(path, _HEADER.pack(MAGIC, VERSION, NUM_CLASSES, len(STACKS), 2, iterations),
+                     struct.pack(f'<{len(STACKS)}H', *STACKS),
+                     struct.pack(f'<{len(cells)}H', *(round(p * _SCALE) for p in cells)))
+
+
+class StrategyTable:
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self.stacks = ()
+        self._map = None
+        self.load()
+
+    def load(self):
+        ## Map the file if present; a missing or stale file leaves the table
+        ## unloaded and level 3 playing like level 2
+        def valid(fields, size):
+            magic, version, classes, stacks, nodes, _ = fields
+            return (magic, version, classes, nodes) == (MAGIC, VERSION, NUM_CLASSES, 2) and \
+                size == _HEADER.size + (stacks + nodes * stacks * classes) * _CELL.size
+
+        mapped = mmap_table.open_map(self.path, _HEADER, valid)
+        if mapped is None:
+            return False
+        table, (_, _, _, stacks, _, _) = mapped
+        self.stacks = struct.unpack_from(f'<{stacks}H', table, _HEADER.size)
+        self._body = _HEADER.size + stacks * _CELL.size
+        self._map = table
+        return True
+
+    @property
+    def loaded(self):
+        return self._map is not None
+
+    def stack_bucket(self, stack):
+        ## Nearest bucket to an effective stack in big blinds, None past the top
+        if stack > self.stacks[-1]:
+            return None
+        index = bisect.bisect_left(self.stacks, stack)
+        if index and stack - self.stacks[index - 1] < self.stacks[index] - stack:
+            index -= 1
+        return index
+
+    def probability(self, node, first, second, stack):
+        ## Chance of going all in (PUSH) or calling all in (CALL) with these
+        ## hole cards and an effective stack of `stack` big blinds; None if
+        ## the spot is not in the table
+        if self._map is None:
+            return None
+        bucket = self.stack_bucket(stack)
+        if bucket is None:
+            return None
+        index = (node * len(self.stacks) + bucket) * NUM_CLASSES + hand_class(first, second)
+        return _CELL.unpack_from(self._map, self._body + index * _CELL.size)[0] / _SCALE
+
+
+# Shared table, mapped on first use
+get_table = mmap_table.Shared(StrategyTable).get
+
+
+def spot(game, player):
+    ## The node the chart was solved for that `player` is in, or None: the
+    ## small blind when everyone else has folded and nobody has entered the
+    ## pot (PUSH), or the big blind facing the small blind's all-in with
+    ## nobody else in (CALL). Any other preflop spot, at any table size, is
+    ## outside the abstraction.
+    if game.community_cards:
+        return None
+    active = game.active_players
+    if len(active) < 2:
+        return None
+    small = active[(game.dealer_position + 1) % len(active)]
+    big = active[(game.dealer_position + 2) % len(active)]
+    live = [p for p in active if not p.folded]
+    if len(live) != 2 or small not in live or big not in live:
+        return None
+    if game.pot != small.total_bet + big.total_bet:
+        return None  # someone who folded since had put chips in
+    if player is small and game.raises == 0 and game.current_bet == game.big_blind \
+            and big.current_bet == game.big_blind and small.current_bet < game.big_blind:
+        return PUSH
+    if player is big and game.raises == 1 and small.chips == 0 \
+            and small.current_bet > big.current_bet:
+        return CALL
+    return None
+
+
+def decision(game, player):
+    ## Level 3 action for `player`, or None outside the push/fold abstraction
+    ## (see spot()), with deep stacks or without a strategy file
+    node = spot(game, player)
+    if node is None:
+        return None
+    opponent = next(p for p in game.active_players if p is not player and not p.folded)
+    stack = min(player.chips + player.current_bet,
+                opponent.chips + opponent.current_bet) / game.big_blind
+    chance = get_table().probability(node, player.hand[0], player.hand[1], stack)
+    if chance is None:
+        return None
+    if game.rng.random() >= chance:
+        return 'fold'
+    # Facing the all-in a call is enough: the deeper big blind has nothing
+    # to gain from putting in more than the small blind can match
+    return 'all_in' if node == PUSH else 'call'
+
+
+def check_spots():
+    ## The chart is only consulted where it was solved: walk a 9-handed and
+    ## a heads-up hand through the spots around it and assert spot() on each
+    from poker_logic import Player, PokerGame
+
+    def deal(seats):
+        game = PokerGame([Player(f"P{i}", 1000, 3) for i in range(seats)], seed=0, headless=True)
+        game.start_hand()
+        return game
+
+    game = deal(9)
+    assert spot(game, game.current_player) is None, "UTG opening 9-handed"
+    game.apply_action(game.current_player, 'raise', 200)
+    assert spot(game, game.current_player) is None, "facing a 2bb open"
+    while len([p for p in game.active_players if not p.folded]) > 2:
+        game.apply_action(game.current_player, 'fold')
+    assert spot(game, game.current_player) is None, "blind facing an open raise"
+
+    game = deal(9)
+    while game.current_player is not game.active_players[(game.dealer_position + 1) % 9]:
+        game.apply_action(game.current_player, 'fold')
+    assert spot(game, game.current_player) == PUSH, "small blind folded to"
+    game.apply_action(game.current_player, 'call')
+    assert spot(game, game.current_player) is None, "big blind facing a limp"
+
+    game = deal(9)
+    game.apply_action(game.current_player, 'call')  # a limper who then folds
+    while game.current_player is not game.active_players[(game.dealer_position + 1) % 9]:
+        game.apply_action(game.current_player, 'fold')
+    assert spot(game, game.current_player) is None, "small blind after a limp"
+
+    game = deal(2)
+    assert spot(game, game.current_player) == PUSH, "heads-up small blind"
+    game.apply_action(game.current_player, 'all_in')
+    assert spot(game, game.current_player) == CALL, "big blind facing the all-in"
+
+    game = deal(2)
+    game.apply_action(game.current_player, 'raise', 250)
+    assert spot(game, game.current_player) is None, "big blind facing a raise that is not all in"
+
+    game = deal(2)
+    game.apply_action(game.current_player, 'call')
+    game.apply_action(game.current_player, 'call')
+    game.next_street()
+    assert spot(game, game.current_player) is None, "after the flop"
+    return True
+
+
+def push_chart(stack, path=DEFAULT_PATH):
+    ## {class name: (push, call)} at one stack size, for inspection
+    table = StrategyTable(path)
+    return {class_name(index): (table.probability(PUSH, *combos[0], stack),
+                                table.probability(CALL, *combos[0], stack))
+            for index, combos in enumerate(class_combos())}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the push/fold strategy table')
+    parser.add_argument('command', choices=['build', 'show', 'check'])
+    parser.add_argument('--path', default=DEFAULT_PATH)
+    parser.add_argument('--samples', type=int, default=200)
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--stack', type=float, default=10, help='effective stack for show')
+    args = parser.parse_args()
+    if args.command == 'build':
+        build(args.path, args.samples, args.iterations, args.workers)
+    elif args.command == 'check':
+        check_spots()
+        print('ok')
+    else:
+        for name, (push, call) in push_chart(args.stack, args.path).items():
+            print(f"{name:>4}  push {push:.2f}  call {call:.2f}")
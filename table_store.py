@@ -0,0 +1,94 @@
+# table_store.py
+# Where GameRegistry keeps table snapshots (GameSession.to_snapshot blobs).
+#
+# MemoryStore only holds tables while they are hibernated and is private
+# to one process. SQLiteStore is durable: the registry writes every table
+# through to it after each locked update, so any worker process can pick a
+# table up, e.g. after a restart or when the set of workers changes.
+#
+#     open_store(None)                   -> MemoryStore()
+#     open_store('memory')               -> MemoryStore()
+#     open_store('sqlite:///tables.db')  -> SQLiteStore('tables.db')
+
+import sqlite3
+import threading
+import time
+
+
+class MemoryStore:
+    durable = False
+
+    def __init__(self):
+        self._blobs = {}
+        self._lock = threading.Lock()
+
+    def load(self, game_id):
+        with self._lock:
+            return self._blobs.get(game_id)
+
+    def save(self, game_id, blob):
+        with self._lock:
+            self._blobs[game_id] = blob
+
+    def delete(self, game_id):
+        with self._lock:
+            self._blobs.pop(game_id, None)
+
+    def __contains__(self, game_id):
+        with self._lock:
+            return game_id in self._blobs
+
+    def __len__(self):
+        with self._lock:
+            return len(self._blobs)
+
+
+class SQLiteStore:
+    ## One connection per thread on a WAL database, so several processes
+    ## can share the file: readers never block the writer
+    durable = True
+
+    def __init__(self, path, timeout=30.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        with self._connection() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS tables ('
+                       'game_id TEXT PRIMARY KEY, blob BLOB NOT NULL, updated REAL NOT NULL)')
+
+    def _connection(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    def load(self, game_id):
+        row = self._connection().execute(
+            'SELECT blob FROM tables WHERE game_id = ?', (game_id,)).fetchone()
+        return row[0] if row else None
+
+    def save(self, game_id, blob):
+        self._connection().execute(
+            'INSERT OR REPLACE INTO tables (game_id, blob, updated) VALUES (?, ?, ?)',
+            (game_id, blob, time.time()))
+
+    def delete(self, game_id):
+        self._connection().execute('DELETE FROM tables WHERE game_id = ?', (game_id,))
+
+    def __contains__(self, game_id):
+        return self._connection().execute(
+            'SELECT 1 FROM tables WHERE game_id = ?', (game_id,)).fetchone() is not None
+
+    def __len__(self):
+        return self._connection().execute('SELECT COUNT(*) FROM tables').fetchone()[0]
+
+
+def open_store(url=None):
+    if not url or url == 'memory':
+        return MemoryStore()
+    if url.startswith('sqlite:///'):
+        return SQLiteStore(url[len('sqlite:///'):])
+    raise ValueError(f"Unknown table store: {url}")
@@ -0,0 +1,246 @@
+# tournament.py
+# AI-only multi-table tournaments on a cooperative scheduler.
+#
+# Every table is a generator task that plays one action per turn, so
+# thousands of tables advance together on one thread with no locks: a
+# table is only ever touched by its own task or, between its hands, by the
+# tournament. When a table finishes a hand its busted players are placed,
+# then it is either broken up (the remaining players fit on one table
+# fewer) or, if it has two or more players more than the smallest table,
+# it sends players there. Moved players sit in from the next hand of their
+# new table; a table short of players waits until it gets some.
+#
+# Blinds follow `levels`. A level lasts hands_per_level hands per starting
+# table, counted over the whole tournament. Runs are reproducible from the
+# seed: every table has its own random.Random derived from it.
+#
+#     python tournament.py --entrants 9000 --seats 9 --seed 1
+
+import argparse
+import random
+import time
+from collections import deque
+
+from equity import batch_seed
+from poker_logic import GamePhase, Player, PokerGame
+
+# (small blind, big blind)
+DEFAULT_LEVELS = [(10, 20), (15, 30), (25, 50), (50, 100), (75, 150), (100, 200), (150, 300),
+                  (200, 400), (300, 600), (400, 800), (600, 1200), (800, 1600), (1000, 2000),
+                  (1500, 3000), (2000, 4000), (3000, 6000), (5000, 10000), (10000, 20000)]
+
+# Yielded by a task to sleep until Scheduler.wake()
+WAIT = object()
+
+
+class Scheduler:
+    ## Round robin over generator tasks. A task runs until it yields; a
+    ## task that yields WAIT is parked until woken.
+    def __init__(self):
+        self._ready = deque()
+        self._parked = set()
+        self.switches = 0
+
+    def spawn(self, task):
+        self._ready.append(task)
+
+    def wake(self, task):
+        if task in self._parked:
+            self._parked.remove(task)
+            self._ready.append(task)
+
+    def run(self, steps=None):
+        ## Run up to `steps` task turns, all of them by default. Returns
+        ## False once no task is ready.
+        ready = self._ready
+        while ready and steps != 0:
+            task = ready.popleft()
+            try:
+                signal = next(task)
+            except StopIteration:
+                continue
+            self.switches += 1
+            if signal is WAIT:
+                self._parked.add(task)
+            else:
+                ready.append(task)
+            if steps is not None:
+                steps -= 1
+        return bool(ready)
+
+    def __len__(self):
+        return len(self._ready) + len(self._parked)
+
+
+class Table:
+    __slots__ = ('id', 'game', 'task', 'closed')
+
+    def __init__(self, table_id, game):
+        self.id = table_id
+        self.game = game
+        self.task = None
+        self.closed = False
+
+
+class Tournament:
+    def __init__(self, entrants, seats=9, starting_chips=1500, levels=DEFAULT_LEVELS,
+                 hands_per_level=10, ai_levels=(1,), seed=0):
+        if entrants < 2:
+            raise ValueError("Need at least 2 entrants")
+        self.seats = seats
+        self.starting_chips = starting_chips
+        self.levels = list(levels)
+        self.level = 0
+        self.hands_played = 0
+        self.remaining = entrants
+        self.finishes = []  # (place, name), worst place first
+        self.events = []
+        self.scheduler = Scheduler()
+        self.elapsed = 0.0
+
+        players = [Player(f"Player {i + 1}", starting_chips, ai_levels[i % len(ai_levels)])
+                   for i in range(entrants)]
+        random.Random(seed).shuffle(players)
+        table_count = -(-entrants // seats)
+        self.level_hands = hands_per_level * table_count
+        self.tables = []
+        for i in range(table_count):
+            seated = players[i::table_count]
+            game = PokerGame(seated, rng=random.Random(batch_seed(seed, i)), headless=True)
+            table = Table(i, game)
+            table.task = self._play(table)
+            self.tables.append(table)
+            self.scheduler.spawn(table.task)
+
+    @property
+    def finished(self):
+        return self.remaining == 1
+
+    def _play(self, table):
+        ## Task for one table: one yield per action, WAIT while short-handed
+        game = table.game
+        while not table.closed:
+            if len(game.players) < 2:
+                if self.finished:
+                    return
+                yield WAIT
+                continue
+            game.small_blind, game.big_blind = self.levels[self.level]
+            game.start_hand()
+            while game.current_phase != GamePhase.SHOWDOWN:
+                if game.street_complete:
+                    game.next_street()
+                else:
+                    player = game.current_player
+                    game.apply_action(player, game.ai_decision(player))
+                yield
+            game.finish_hand()
+            self._hand_finished(table)
+            yield
+
+    def _hand_finished(self, table):
+        self.hands_played += 1
+        level = min(self.hands_played // self.level_hands, len(self.levels) - 1)
+        if level != self.level:
+            self.level = level
+            small, big = self.levels[level]
+            self.events.append({'type': 'level', 'level': level + 1, 'blinds': [small, big]})
+
+        game = table.game
+        busted = [p for p in game.players if p.chips <= 0]
+        if busted:
+            # Players out on the same hand: the bigger starting stack places higher
+            busted.sort(key=lambda p: p.total_bet)
+            for player in busted:
+                game.players.remove(player)
+                self.finishes.append((self.remaining, player.name))
+                self.events.append({'type': 'eliminated', 'player': player.name,
+                                    'place': self.remaining, 'table': table.id})
+                self.remaining -= 1
+            if game.dealer_position >= len(game.players):
+                game.dealer_position = 0
+        if self.finished:
+            winner = next(p for t in self.tables if not t.closed for p in t.game.players)
+            self.finishes.append((1, winner.name))
+            self.events.append({'type': 'winner', 'player': winner.name, 'chips': winner.chips})
+            for other in self.tables:
+                other.closed = True
+                self.scheduler.wake(other.task)
+            return
+        self._balance(table)
+
+    def _balance(self, table):
+        ## Break `table` up or even it out against the smallest other table.
+        ## Only `table` is between hands, so players only ever leave it.
+        others = [t for t in self.tables if not t.closed and t is not table]
+        if not others:
+            return
+        if self.remaining <= len(others) * self.seats:
+            table.closed = True
+            for player in list(table.game.players):
+                self._move(player, table, min(others, key=lambda t: len(t.game.players)))
+            self.events.append({'type': 'table_broken', 'table': table.id})
+            return
+        smallest = min(others, key=lambda t: len(t.game.players))
+        while len(table.game.players) > len(smallest.game.players) + 1:
+            self._move(table.game.players[-1], table, smallest)
+            smallest = min(others, key=lambda t: len(t.game.players))
+
+    def _move(self, player, source, target):
+        source.game.players.remove(player)
+        player.hand = []
+        player.folded = True  # sits out the hand in progress at the new table
+        target.game.players.append(player)
+        self.events.append({'type': 'moved', 'player': player.name,
+                            'from': source.id, 'to': target.id})
+        self.scheduler.wake(target.task)
+
+    def stream(self, steps=5000):
+        ## Play the tournament, yielding the events of every `steps` table
+        ## turns as a list
+        while True:
+            start = time.perf_counter()
+            running = self.scheduler.run(steps)
+            self.elapsed += time.perf_counter() - start
+            events, self.events = self.events, []
+            if events:
+                yield events
+            if not running:
+                return
+
+    def run(self):
+        for _ in self.stream():
+            pass
+        return self
+
+    def standings(self):
+        ## (place, name), winner first
+        return sorted(self.finishes)
+
+    def stats(self):
+        return {
+            'remaining': self.remaining,
+            'tables': sum(1 for t in self.tables if not t.closed),
+            'level': self.level + 1,
+            'blinds': list(self.levels[self.level]),
+            'hands': self.hands_played,
+            'hands_per_sec': self.hands_played / self.elapsed if self.elapsed else 0.0,
+            'switches': self.scheduler.switches,
+        }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run an AI-only tournament')
+    parser.add_argument('--entrants', type=int, default=900)
+    parser.add_argument('--seats', type=int, default=9)
+    parser.add_argument('--chips', type=int, default=1500)
+    parser.add_argument('--hands-per-level', type=int, default=10)
+    parser.add_argument('--levels', type=int, nargs='+', default=[1], help='AI levels, cycled')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    tournament = Tournament(args.entrants, args.seats, args.chips,
+                            hands_per_level=args.hands_per_level, ai_levels=args.levels,
+                            seed=args.seed).run()
+    print(tournament.stats())
+    for place, name in tournament.standings()[:10]:
+        print(f"{place:>5}  {name}")